@@ -10,12 +10,37 @@ Big thanks to Grimmy for its documentation here: http://www.grimware.org/doku.ph
 
 import sys
 import argparse
+import collections
+import multiprocessing
+import json
+import os
+import time
+
+try:
+    from cpcdemotools.crtc.trace_sinks import NullTraceSink, TextTraceSink, \
+            BinaryTraceSink
+except ImportError:
+    # Run from the source tree
+    from trace_sinks import NullTraceSink, TextTraceSink, BinaryTraceSink
+
+# Version of the timing model of SimpleCRTC/SimpleGA.
+# Must be increased each time the emulated timings change in order to
+# invalidate the transitions stored in a TransitionCache.
+TIMING_MODEL_VERSION = 2
+
+# Duration of the sequence writing a CRTC register:
+# ld bc, 0xbc00 + register (3), out (c), c (4), ld bc, 0xbd00 + value (3),
+# out (c), c (4)
+OUT_NOPS = 3 + 4 + 3 + 4
 
 class SimpleGA(object):
     """Very minimilistic GA implementation.
     YOU MUST CALL EXECUTE AT EACH NOP (BEFORE CRTC WORK)
     """
 
+    __slots__ = ('_nop_counter', '_interupt_counter', '_int_raised',
+                 '_vsync_occured_counter')
+
     def __init__(self):
         self._nop_counter = 0
         self._interupt_counter = 0
@@ -57,13 +82,64 @@ class SimpleGA(object):
         """A vsync just occured"""
         self._vsync_occured_counter = 2
 
+    def get_nb_quiet_hsync_falls(self):
+        """Return the number of hsync falls which can happen without
+        raising an interrupt or being part of the two hsync wait after a vsync.
+        """
+        if self._vsync_occured_counter != -1:
+            return 0
+        return 51 - self._interupt_counter
+
+    def skip(self, nb_nops, nb_hsync_falls=0):
+        """Fast forward nb_nops nops.
+
+        Parameters
+        ----------
+            - nb_nops: int
+                Number of nops to skip
+            - nb_hsync_falls: int
+                Number of hsync falls happening during these nops.
+                Must not be greater than get_nb_quiet_hsync_falls()
+        """
+        self._nop_counter = self._nop_counter + nb_nops
+        self._interupt_counter = self._interupt_counter + nb_hsync_falls
+        if nb_nops:
+            self._int_raised = False
+
+    def snapshot(self):
+        """Return the state of the GA as a tuple."""
+        return (self._nop_counter, self._interupt_counter, self._int_raised,
+                self._vsync_occured_counter)
+
+    def restore(self, state):
+        """Restore a state returned by snapshot."""
+        (self._nop_counter, self._interupt_counter, self._int_raised,
+                self._vsync_occured_counter) = state
+
 class SimpleCRTC(object):
     """Simple implementation of CRTC.
     Contains the minimum to work with R7 and R2 transitions
     """
 
-    def __init__(self):
-        """Initialise CRTC register values"""
+    __slots__ = ('_fast_forward', '_sink', '_registers', '_HCC', '_VCC', '_VLC',
+                 '_VSyncCounter', '_HSyncCounter', '_nop_counter', '_ga')
+
+    _ga_class = SimpleGA
+
+    def __init__(self, fast_forward=True, sink=None):
+        """Initialise CRTC register values
+
+        Parameters
+        ----------
+            - fast_forward: bool
+                if True, executions without printing jump from event to event
+                instead of emulating each nop
+            - sink: NullTraceSink
+                Destination of the printed information (text on the
+                standard output if None)
+        """
+        self._fast_forward = fast_forward
+        self._sink = sink if sink is not None else TextTraceSink()
 
         # Set initial values of registers
         self._registers = [63, 40, 46, 0x8e,
@@ -81,7 +157,23 @@ class SimpleCRTC(object):
         self._HSyncCounter = 0
         self._nop_counter = 0
 
-        self._ga = SimpleGA()
+        self._ga = self._ga_class()
+
+    def snapshot(self):
+        """Return the state of the CRTC (and its GA) as a tuple.
+        It can be restored as many times as needed to try several
+        executions from the same point."""
+        return (tuple(self._registers), self._HCC, self._VCC, self._VLC,
+                self._VSyncCounter, self._HSyncCounter, self._nop_counter,
+                self._ga.snapshot())
+
+    def restore(self, state):
+        """Restore a state returned by snapshot."""
+        (registers, self._HCC, self._VCC, self._VLC,
+                self._VSyncCounter, self._HSyncCounter, self._nop_counter,
+                ga_state) = state
+        self._registers = list(registers)
+        self._ga.restore(ga_state)
 
     def R0(self):
         return self._registers[0]
@@ -123,6 +215,10 @@ class SimpleCRTC(object):
         self._registers[register] = value
 
 
+    def get_registers(self):
+        """Return a copy of the current register values."""
+        return list(self._registers)
+
     def get_HCC(self):
         """Return Horizontal Char Counter value (HCC).
         Goes from 0 to R0
@@ -168,6 +264,11 @@ class SimpleCRTC(object):
         """Test if we are in hsync."""
         return self._HSyncCounter != 0
 
+    def is_VSync_start(self):
+        """Test if the vsync has just started (i.e. the last nop ended the
+        line where VCC reached R7)."""
+        return self._HCC == 0 and self._VSyncCounter == self.get_VSync_width()
+
     def _decrease_HSyncCounter(self):
         """Decrease HSYNC counter and increment GA one if needed."""
 
@@ -204,11 +305,132 @@ class SimpleCRTC(object):
                 Do we print on screen ?
         """
 
+        verbose = verbose and self._sink.enabled
+        if not verbose and self._fast_forward:
+            self.fast_forward(n)
+            return
+
         for i in range(n):
             if verbose:
-              self.print_state_per_char_line()
+              self._trace_state_per_char_line()
             self.execute()
 
+        if verbose:
+            self.flush_trace()
+
+    def fast_forward(self, n):
+        """Execute the CRTC during n NOPS by jumping from event to event.
+        The final state is the same than after n calls to execute.
+
+        Parameters
+        ----------
+            - n : int
+                Number of nop to execute
+        """
+        while n > 0:
+            n = n - self._fast_step(n)
+
+    def _fast_step(self, limit=None):
+        """Execute the CRTC until the next event (HSYNC start or end, end of
+        line). Whole lines without HSYNC crossing, VLC wrap or GA interrupt are
+        skipped at once.
+        Events can only change the CRTC/GA state observed by the various
+        is_* methods in the very last executed nop.
+
+        Parameters
+        ----------
+            - limit: int
+                Maximum number of nops to execute (no limit if None)
+
+        Returns
+        -------
+            Number of executed nops
+        """
+        line_length = self._registers[0] + 1
+
+        # Skip whole lines
+        if self._HCC == 0 and self._HSyncCounter == 0:
+            nb_lines, hsync_in_line = self._get_nb_plain_lines()
+            if limit is not None:
+                nb_lines = min(nb_lines, limit // line_length)
+
+            if nb_lines > 0:
+                nb_nops = nb_lines * line_length
+                self._nop_counter = self._nop_counter + nb_nops
+                self._VLC = self._VLC + nb_lines
+                if self._VSyncCounter != 0:
+                    self._VSyncCounter = self._VSyncCounter - nb_lines
+                self._ga.skip(nb_nops, nb_lines if hsync_in_line else 0)
+                return nb_nops
+
+        # Skip the end of the line until the next event
+        nb_nops = self._get_nb_nops_before_event()
+        if limit is not None and nb_nops > limit:
+            self._skip_nops(limit)
+            return limit
+
+        self._skip_nops(nb_nops - 1)
+        self.execute()
+        return nb_nops
+
+    def _get_nb_plain_lines(self):
+        """Return the number of complete lines, starting from the current one,
+        where nothing happens except incrementing VLC (and decreasing VSYNC
+        counter). Must be called at the beginning of a line without HSYNC.
+
+        Returns
+        -------
+            - number of lines
+            - True if a complete HSYNC happens in each of these lines
+        """
+        if self._VLC >= self._registers[9]:
+            return 0, False
+
+        nb_lines = self._registers[9] - self._VLC
+        if self._VSyncCounter != 0:
+            nb_lines = min(nb_lines, self._VSyncCounter)
+
+        R0 = self._registers[0]
+        R2 = self._registers[2]
+        width = self.get_HSync_width()
+        hsync_in_line = width != 0 and R2 >= 1 and R2 <= R0 + 1
+        if hsync_in_line:
+            # HSYNC would continue on next line
+            if R2 + width > R0 + 1:
+                return 0, False
+
+            nb_lines = min(nb_lines, self._ga.get_nb_quiet_hsync_falls())
+
+        return nb_lines, hsync_in_line
+
+    def _get_nb_nops_before_event(self):
+        """Return the number of nops to execute in order to reach the next one
+        doing more than incrementing HCC (HSYNC start or end, end of line)."""
+        if self._HCC <= self._registers[0]:
+            nb_nops = self._registers[0] + 1 - self._HCC
+        else:
+            nb_nops = 1
+
+        R2 = self._registers[2]
+        if R2 > self._HCC and R2 - self._HCC < nb_nops:
+            nb_nops = R2 - self._HCC
+
+        if self._HSyncCounter != 0 and self._HSyncCounter < nb_nops:
+            nb_nops = self._HSyncCounter
+
+        return nb_nops
+
+    def _skip_nops(self, n):
+        """Execute n nops known to only increment HCC."""
+        if n == 0:
+            return
+
+        self._HCC = self._HCC + n
+        self._nop_counter = self._nop_counter + n
+        if self._HSyncCounter != 0:
+            self._HSyncCounter = self._HSyncCounter - n
+        self._ga.skip(n)
+
     def execute(self):
         """Do all the things during the life of the CRTC during one nop"""
         self._ga.execute()
@@ -248,8 +470,9 @@ class SimpleCRTC(object):
            
 
 
-    def print_state_per_char_line(self):
-        """Print CRTC state per each char_line"""
+    def _trace_state_per_char_line(self):
+        """Send the CRTC state to the trace sink on the first line of each
+        char line (without flushing the sink)"""
   #      if self._ga.is_int_raised():
   #          sys.stdout.write(' Int (line %d/%d) at %d nops' % \
   #              (self.get_VCC(),self.get_VLC(), self.get_nops()))
@@ -257,28 +480,21 @@ class SimpleCRTC(object):
         if self.get_VLC() != 0:
             return
 
-        self.print_state()
+        self._sink.state(self)
+
+    def print_state_per_char_line(self):
+        """Print CRTC state per each char_line"""
+        self._trace_state_per_char_line()
+        self.flush_trace()
 
     def print_state(self):
         """Print CRTC state on screen"""
+        self._sink.state(self)
+        self.flush_trace()
 
-       
-        if self._HCC == 0:
-            if self._VCC == self._registers[6]:
-                sys.stdout.write(' R6')
-            elif self._VCC == self._registers[7]:
-                sys.stdout.write(' R7')
-
-            sys.stdout.write("\n%02d " % self._VCC)
-
-        if self.is_HSync():
-            sys.stdout.write("H")
-        elif self.is_VSync():
-            sys.stdout.write('V')
-        elif self.is_border():
-            sys.stdout.write('B')
-        else:
-            sys.stdout.write('C')
+    def flush_trace(self):
+        """Write the printed information buffered by the trace sink"""
+        self._sink.flush()
 
     def run_until_next_vsync(self, _print=False):
         """Launch CRTC emulation, and stop when a vbl is reatched
@@ -289,57 +505,110 @@ class SimpleCRTC(object):
                 if True, print CRTC info on screen
         """
 
+        _print = _print and self._sink.enabled
+        if not _print and self._fast_forward:
+            while self.is_VSync():
+                self._fast_step()
+            while not self.is_VSync():
+                self._fast_step()
+            return
+
         #Leave current vbl if we are inside
         while self.is_VSync():
             if _print:
-                self.print_state_per_char_line()
+                self._trace_state_per_char_line()
             self.execute()
 
         #Loop until we reach vbl
         while not self.is_VSync():
             if _print:
-                self.print_state_per_char_line()
+                self._trace_state_per_char_line()
+            self.execute()
+
+        if _print:
+            self._sink.text("\n")
+            self.flush_trace()
+
+    def run_until_next_line(self):
+        """Launch CRTC emulation, and stop at the beginning of the next
+        line"""
+        if self._HCC <= self._registers[0]:
+            self.execute_n_nops(self._registers[0] + 1 - self._HCC, False)
+        else:
+            self.execute_n_nops(1, False)
+
+    def run_until_next_event(self, limit=None):
+        """Launch CRTC emulation, and stop after the next event (HSYNC start
+        or end, end of line) without printing anything.
+
+        Parameters
+        ----------
+            - limit: int
+                Maximum number of nops to execute (no limit if None)
+
+        Returns
+        -------
+            Number of executed nops
+        """
+        if self._fast_forward:
+            return self._fast_step(limit)
+        self.execute()
+        return 1
+
+    def is_int_raised(self):
+        """Test if the GA has just raised an interrupt."""
+        return self._ga.is_int_raised()
+
+    def run_until_next_interrupt(self, _print=False):
+        """Launch CRTC emulation, and stop when the GA raises an interrupt.
+        Does nothing if the interrupt is already raised.
+
+        Parameters
+        ----------
+            - _print: boolean
+                if True, print CRTC info on screen
+        """
+        _print = _print and self._sink.enabled
+        if not _print and self._fast_forward:
+            while not self.is_int_raised():
+                self._fast_step()
+            return
+
+        while not self.is_int_raised():
+            if _print:
+                self._trace_state_per_char_line()
             self.execute()
 
         if _print:
-            sys.stdout.write("\n")
+            self.flush_trace()
 
     def print_horizontal_top_rule(self):
         """Print the horinzonal rule"""
-        sys.stdout.write('   ')
-        for i in range(64):
-            sys.stdout.write("%d" % (i/10))
-        sys.stdout.write("\n")
-        sys.stdout.write('   ')
-        for i in range(64):
-            sys.stdout.write("%d" % (i%10))
+        tens = "".join("%d" % (i/10) for i in range(64))
+        units = "".join("%d" % (i%10) for i in range(64))
+        self._sink.text('   %s\n   %s' % (tens, units))
+        self.flush_trace()
 
     def print_horizontal_bottom_rule(self):
         """Print the horinzonal rule"""
-        sys.stdout.write('   ')
-        for i in range(64):
-            if i == self._registers[1]:
-                sys.stdout.write('R')
-            elif i == self._registers[2]:
-                sys.stdout.write('R')
-            elif i == self._registers[2] + self.get_HSync_width():
-                sys.stdout.write('R')
-            else:
-                sys.stdout.write(" ")
-
-        sys.stdout.write("\n")
-        sys.stdout.write('   ')
+        names = []
+        numbers = []
         for i in range(64):
             if i == self._registers[1]:
-                sys.stdout.write('1')
+                names.append('R')
+                numbers.append('1')
             elif i == self._registers[2]:
-                sys.stdout.write('2')
+                names.append('R')
+                numbers.append('2')
             elif i == self._registers[2] + self.get_HSync_width():
-                sys.stdout.write('3')
+                names.append('R')
+                numbers.append('3')
             else:
-                sys.stdout.write(" ")
+                names.append(" ")
+                numbers.append(" ")
 
-        sys.stdout.write("\n")
+        self._sink.text('   %s\n   %s\n' % ("".join(names), "".join(numbers)))
+        self.flush_trace()
 
 
     def print_configuration(self):
@@ -353,26 +622,318 @@ class SimpleCRTC(object):
 
         self.print_registers()
 
-        print ('%d nops' % self.get_nops())
+        self._sink.text('%d nops\n' % self.get_nops())
+        self.flush_trace()
 
     def print_registers(self):
         """Print register values"""
 
-        print 'Register values'
         vals = [ "R%d:0x%x" % (crtc, value) for crtc, value in enumerate(self._registers)]
-        sys.stdout.write("\n".join(vals))
-        sys.stdout.write("\n")
+        self._sink.text('Register values\n%s\n' % "\n".join(vals))
+        self.flush_trace()
+
+
+class FastGA(SimpleGA):
+    """SimpleGA used by FastCRTC (which updates its counters itself)."""
+
+    __slots__ = ()
+
+
+class FastCRTC(SimpleCRTC):
+    """SimpleCRTC optimised for step by step execution.
+    The registers used at each nop are cached (and updated only by
+    set_register and restore) and execute does not call any other method of
+    the CRTC or the GA in the common case.
+    """
+
+    __slots__ = ('_R0', '_R2', '_R4', '_R7', '_R9',
+                 '_hsync_width', '_vsync_width')
+
+    _ga_class = FastGA
+
+    def __init__(self, fast_forward=True, sink=None):
+        super(FastCRTC, self).__init__(fast_forward, sink)
+        self._update_cache()
+
+    def _update_cache(self):
+        """Update the cached values of the registers."""
+        self._R0 = self._registers[0]
+        self._R2 = self._registers[2]
+        self._R4 = self._registers[4]
+        self._R7 = self._registers[7]
+        self._R9 = self._registers[9]
+        self._hsync_width = self.get_HSync_width()
+        self._vsync_width = self.get_VSync_width()
+
+    def set_register(self, register, value):
+        """Modify the value of the register"""
+        super(FastCRTC, self).set_register(register, value)
+        self._update_cache()
+
+    def restore(self, state):
+        """Restore a state returned by snapshot."""
+        super(FastCRTC, self).restore(state)
+        self._update_cache()
+
+    def execute(self):
+        """Do all the things during the life of the CRTC during one nop"""
+        ga = self._ga
+        ga._nop_counter += 1
+        ga._int_raised = False
+        self._nop_counter += 1
+
+        # Increment horizontal counter
+        HCC = self._HCC + 1
+        if self._HSyncCounter != 0:
+            self._HSyncCounter -= 1
+            if self._HSyncCounter == 0:
+                ga.hsync_fall()
+
+        if HCC == self._R2:
+            self._HSyncCounter = self._hsync_width
+
+        # New line ?
+        if HCC > self._R0:
+            HCC = 0
+
+            # Increment vertical line counter
+            if self._VSyncCounter != 0:
+                self._VSyncCounter -= 1
+
+            self._VLC += 1
+            if self._VLC > self._R9:
+                self._VLC = 0
+
+                # Increment vertical char counter
+                self._VCC += 1
+
+                if self._VCC == self._R7 and self._VSyncCounter == 0:
+                    self._VSyncCounter = self._vsync_width
+                    ga.vsync_occurs()
+
+                # Verify looping of VCC
+                if self._VCC > self._R4:
+                    self._VCC = 0
+
+        self._HCC = HCC
+
+
+FrameTiming = collections.namedtuple('FrameTiming', [
+    'frame_length',     # Number of nops of a frame
+    'vsync_start',      # Nop where VSYNC starts (None if no VSYNC)
+    'hsync_start',      # HCC where HSYNC starts (None if no HSYNC)
+    'hsync_stop',       # HCC where HSYNC stops (> R0 if on next line)
+    'interrupts',       # Nops where GA interrupts are raised
+    'closed_form',      # False if computed with the emulator
+    ])
+
+
+def compute_frame_timing(registers):
+    """Compute the timing of a stable frame without emulation.
 
+    Nop positions are counted from the beginning of the frame (HCC, VLC and
+    VCC at 0) and correspond to the value of SimpleCRTC.get_nops() just after
+    the event. Register sets which cannot be solved arithmetically (HSYNC
+    crossing lines, no VSYNC, frame shorter than the VSYNC) are emulated.
+
+    Parameters
+    ----------
+        - registers: list
+            Values of the CRTC registers (at least R0 to R9)
+
+    Returns
+    -------
+        A FrameTiming
+    """
+    R0, R2, R3, R4, R7, R9 = [registers[_] for _ in (0, 2, 3, 4, 7, 9)]
+    width = R3 & 0b1111
+
+    line_length = R0 + 1
+    nb_lines = (R9 + 1) * (R4 + 1)
+    frame_length = line_length * nb_lines
+
+    if width == 0 or R2 < 1 or R2 + width > line_length \
+            or R7 < 1 or R7 > R4 + 1 \
+            or nb_lines < 16:
+        return _emulate_frame_timing(registers)
+
+    # VSYNC starts at the end of the line where VCC reaches R7.
+    vsync_line = R7 * (R9 + 1)
+
+    # The GA counter is reset at the second HSYNC after the VSYNC
+    # and then raises an interrupt every 52 lines
+    reset_line = vsync_line + 1
+    lines = [reset_line + 52 * k for k in range(1, (nb_lines - 1) // 52 + 1)]
+    if nb_lines % 52 < 32:
+        lines.append(reset_line)
+
+    interrupts = sorted((line % nb_lines) * line_length + R2 + width
+                        for line in lines)
+
+    return FrameTiming(frame_length=frame_length,
+                       vsync_start=(vsync_line % nb_lines or nb_lines) * line_length,
+                       hsync_start=R2,
+                       hsync_stop=R2 + width,
+                       interrupts=interrupts,
+                       closed_form=True)
+
+
+def _emulate_frame_timing(registers):
+    """Compute the timing of a frame with SimpleCRTC.
+    The frame following two synchronisation frames is used.
+    """
+    crtc = FastCRTC()
+    for register, value in enumerate(registers):
+        crtc.set_register(register, value)
+
+    frame_length = (crtc.R0() + 1) * (crtc.R9() + 1) * (crtc.R4() + 1)
+    crtc.fast_forward(2 * frame_length)
+    crtc.reset_nops()
+
+    vsync_start = None
+    interrupts = []
+    while crtc.get_nops() < frame_length:
+        crtc.run_until_next_event(frame_length - crtc.get_nops())
+        if crtc.is_int_raised():
+            interrupts.append(crtc.get_nops())
+        if crtc.is_VSync_start():
+            vsync_start = crtc.get_nops()
+
+    width = crtc.get_HSync_width()
+    if width != 0 and crtc.R2() >= 1 and crtc.R2() <= crtc.R0() + 1:
+        hsync_start, hsync_stop = crtc.R2(), crtc.R2() + width
+    else:
+        hsync_start, hsync_stop = None, None
+
+    return FrameTiming(frame_length=frame_length,
+                       vsync_start=vsync_start,
+                       hsync_start=hsync_start,
+                       hsync_stop=hsync_stop,
+                       interrupts=interrupts,
+                       closed_form=False)
+
+
+TransitionResult = collections.namedtuple('TransitionResult', [
+    'delta',            # Nops waited before starting the transition
+    'source',           # Generated z80 source of the transition
+    'nops',             # Duration of the transition frame
+    ])
+
+
+class TransitionCache(object):
+    """Persistent cache of solved transitions stored in a json file.
+    Solutions are keyed on the register, the start and stop values, the
+    register values before the transition and the timing model version.
+    """
+
+    def __init__(self, fname):
+        """Load the cache.
+
+        Parameters
+        ----------
+            - fname: str
+                Name of the json file (created on save if it does not exist)
+        """
+        self._fname = fname
+
+        if os.path.exists(fname):
+            f = open(fname)
+            self._solutions = json.load(f)
+            f.close()
+        else:
+            self._solutions = {}
+
+    def __len__(self):
+        return len(self._solutions)
+
+    def _get_key(self, register, start, stop, registers):
+        return '%d:%d:%d:%s:%d' % (register, start, stop,
+                                   ','.join(str(_) for _ in registers),
+                                   TIMING_MODEL_VERSION)
+
+    def get(self, register, start, stop, registers):
+        """Return the TransitionResult stored for this transition, or None."""
+        solution = self._solutions.get(
+                self._get_key(register, start, stop, registers))
+        if solution is None:
+            return None
+
+        delta, source, nops = solution
+        return TransitionResult(delta=delta, source=str(source), nops=nops)
+
+    def store(self, register, start, stop, registers, result):
+        """Store the TransitionResult of a transition.
+        The file is only written by save."""
+        self._solutions[self._get_key(register, start, stop, registers)] = \
+                list(result)
+
+    def save(self):
+        """Write the cache on disk."""
+        tmp_fname = self._fname + '.tmp'
+        f = open(tmp_fname, 'w')
+        json.dump(self._solutions, f)
+        f.close()
+        os.rename(tmp_fname, self._fname)
 
 
 class TransitionHelper(object):
     """Build and validate CRTC transitions."""
 
-    def __init__(self):
-        self._crtc = SimpleCRTC()
+    def __init__(self, verbose=True, cache=None, sink=None):
+        """Initialise the helper.
+
+        Parameters
+        ----------
+            - verbose: bool
+                if False, nothing is printed on screen (when sink is None)
+            - cache: TransitionCache
+                if not None, transitions are first searched in the cache,
+                and solved ones are stored in it
+            - sink: NullTraceSink
+                Destination of the printed information (text on the
+                standard output or nothing, depending on verbose, if None)
+        """
+        if sink is None:
+            sink = TextTraceSink() if verbose else NullTraceSink()
+        self._sink = sink
+        self._crtc = FastCRTC(sink=sink)
+        self._cache = cache
 
         self._reset_source_code()
 
+    def get_registers(self):
+        """Return a copy of the current register values."""
+        return self._crtc.get_registers()
+
+    def _get_cached_transition(self, register, start, stop, registers):
+        """Return the cached TransitionResult of the transition and add its
+        source code, or None if not in cache. The CRTC is not executed."""
+        if self._cache is None:
+            return None
+
+        result = self._cache.get(register, start, stop, registers)
+        if result is None:
+            return None
+
+        self._source_code += result.source
+        self._sink.text('Transition found in cache (%d nops)\n' % result.nops)
+        self._sink.text(self._source_code + '\n')
+        return result
+
+    def _store_transition(self, register, start, stop, registers, result):
+        """Store the TransitionResult in the cache (if any)."""
+        if self._cache is None:
+            return
+
+        self._cache.store(register, start, stop, registers, result)
+        self._cache.save()
+
+    def get_frame_length(self):
+        """Return the number of nops of a stable frame with the current
+        register values. The transition frame must last the same time.
+        """
+        return compute_frame_timing(self._crtc._registers).frame_length
+
     def _reset_source_code(self):
         self._source_code =  " ; Generated source by crtc_transition_helper.py\n"
         self._source_code += " ; (Krusty/Benediction (c) 2011\n\n"
@@ -382,10 +943,10 @@ class TransitionHelper(object):
         """Change a CRTC register value, and execute the crtc tp reach the
         number of nops to do
 
-        ld bc, 0xbc00 + register    ;4
-        out (c), c                  ;5
-        ld bc, 0xbd00 + value       ;4
-        out (c), c                  ;5
+        ld bc, 0xbc00 + register    ;3
+        out (c), c                  ;4
+        ld bc, 0xbd00 + value       ;3
+        out (c), c                  ;4
 
 
         Parameters
@@ -398,7 +959,7 @@ class TransitionHelper(object):
                 Do we print on screen ?
         """
 
-        self._crtc.execute_n_nops(4+5+4+5, verbose)
+        self._crtc.execute_n_nops(OUT_NOPS, verbose)
         self._crtc.set_register(register, value)
 
         self._source_code += """
@@ -409,66 +970,99 @@ class TransitionHelper(object):
 """ % (register, value)
 
 
-    def compute_r2_transition(self, start, stop):
-        """Compute and validate a R2 transition.
-        Assert transition is tested after an halt
-        """
+    def _display_n_nops(self, n):
+        """Execute n nops and print the state of each of them in verbose
+        mode."""
+        if not self._sink.enabled:
+            self._crtc.fast_forward(n)
+            return
+
+        for i in range(n):
+            self._sink.state(self._crtc)
+            self._crtc.execute()
 
+    def _configure_r2_start(self, start):
+        """Set the registers before a R2 transition."""
         self._crtc.set_register(6, 39)
         # Configure start
         if start != self._crtc.R2():
             self._crtc.set_register(2, start)
             self._crtc.rest_internal_counters()
 
-        if start == stop:
-            print 'Ugh?!'
-        elif stop < start:
-            success= False
-            for delta in range(65):
-                try:
-                    self._compute_r2_transition_decrease(start, stop, delta)
-                    success = True
-                    break
-                except:
-                    pass
+    def compute_r2_transition(self, start, stop):
+        """Compute and validate a R2 transition.
+        Assert transition is tested after an halt
 
-            if not success:
-                    print "Problem not solved :("
+        Returns
+        -------
+            A TransitionResult, or None if the transition is not solved
+        """
+        try:
+            return self._compute_r2_transition(start, stop)
+        finally:
+            self._sink.flush()
 
+    def _compute_r2_transition(self, start, stop):
+        """Compute and validate a R2 transition."""
 
-        else:
-            success= False
-            for delta in range(65):
-                try:
-                    self._compute_r2_transition_increase(start, stop, delta)
-                    success = True
-                    break
-                except:
-                    pass
-
-            if not success:
-                    print "Problem not solved :("
+        self._configure_r2_start(start)
+        self._frame_length = self.get_frame_length()
+        registers = self.get_registers()
 
-    def _compute_r2_transition_increase(self, start, stop, delta = 0):
-        """Compute the transition"""
-        self._source_code += """
- ; Transition from R2=%d to R2=%d
-""" % (start, stop)
+        if start == stop:
+            self._sink.text('Ugh?!\n')
+            return None
 
+        result = self._get_cached_transition(2, start, stop, registers)
+        if result is not None:
+            return result
+
+        if stop < start:
+            compute = self._compute_r2_transition_decrease
+        else:
+            compute = self._compute_r2_transition_increase
 
         # Wait until being at a hsync (always the same vertical position)
         self._crtc.print_horizontal_top_rule()
         self._crtc.run_until_next_vsync(_print=False)
         self._crtc.reset_nops()
 
-        while not self._crtc._ga.is_int_raised():
-                self._crtc.execute()
+        self._crtc.run_until_next_interrupt()
         self._crtc._ga._int_raised = False
 
+        # All the attempts start from this synchronised state
+        synchronised = self._crtc.snapshot()
+
+        begin = len(self._source_code)
+        for delta in range(65):
+            self._crtc.restore(synchronised)
+            if not compute(start, stop, delta):
+                # Forget the source code of the failed attempt
+                self._source_code = self._source_code[:begin]
+                continue
+
+            result = TransitionResult(delta=delta,
+                                      source=self._source_code[begin:],
+                                      nops=self._crtc.get_nops())
+            self._store_transition(2, start, stop, registers, result)
+            return result
+
+        self._sink.text("Problem not solved :(\n")
+        return None
+
+    def _compute_r2_transition_increase(self, start, stop, delta = 0):
+        """Compute the transition from the interrupt following the vsync.
+
+        Returns
+        -------
+            True if the transition frame has the expected length
+        """
+        self._source_code += """
+ ; Transition from R2=%d to R2=%d
+""" % (start, stop)
+
         # Print some lines of information to cleanup vars
-        for i in range(64*10 + delta):
-            self._crtc.print_state()
-            self._crtc.execute()
+        self._display_n_nops(64*10 + delta)
 
         self._source_code += """
     defs %d
@@ -513,39 +1107,30 @@ class TransitionHelper(object):
 
 
         #Display screen after
-        for i in range(64*10):
-            self._crtc.print_state()
-            self._crtc.execute()
+        self._display_n_nops(64*10)
 
         # Wait end of screen
         self._crtc.run_until_next_vsync(_print=False)
-        print 'Transition done in %d nops' % self._crtc.get_nops()
-        print self._source_code
-        assert self._crtc.get_nops() == 64*39*8
-
-
+        if self._crtc.get_nops() != self._frame_length:
+            return False
 
+        self._sink.text('Transition done in %d nops\n' % self._crtc.get_nops())
+        self._sink.text(self._source_code + '\n')
+        return True
 
     def _compute_r2_transition_decrease(self, start, stop, delta):
-        """Compute the transition"""
+        """Compute the transition from the interrupt following the vsync.
+
+        Returns
+        -------
+            True if the transition frame has the expected length
+        """
         self._source_code += """
  ; Transition from R2=%d to R2=%d
 """ % (start, stop)
 
-
-        # Wait until being at a hsync (always the same vertical position)
-        self._crtc.print_horizontal_top_rule()
-        self._crtc.run_until_next_vsync(_print=False)
-        self._crtc.reset_nops()
-
-        while not self._crtc._ga.is_int_raised():
-                self._crtc.execute()
-        self._crtc._ga._int_raised = False
-
         # Print some lines of information to cleanup vars
-        for i in range(64*10 + delta):
-            self._crtc.print_state()
-            self._crtc.execute()
+        self._display_n_nops(64*10 + delta)
         self._source_code += """
     defs %d
 """ % delta
@@ -574,7 +1159,7 @@ class TransitionHelper(object):
     ld a, %d           ; 2
     inc b              ; 1
     out (c), a         ; 4
-"""
+""" % stop
         self._crtc.execute_n_nops(3+4+2+1+4, verbose=True)
         self._crtc.set_register(2, stop)
 
@@ -590,37 +1175,62 @@ class TransitionHelper(object):
 
 
         #Display screen after
-        for i in range(64*10):
-            self._crtc.print_state()
-            self._crtc.execute()
+        self._display_n_nops(64*10)
 
         # Wait end of screen
         self._crtc.run_until_next_vsync(_print=False)
-        assert self._crtc.get_nops() == 64*39*8
-        print 'Transition done in %d nops' % self._crtc.get_nops()
+        if self._crtc.get_nops() != self._frame_length:
+            return False
 
-
-        print self._source_code
+        self._sink.text('Transition done in %d nops\n' % self._crtc.get_nops())
+        self._sink.text(self._source_code + '\n')
+        return True
 
     def compute_r7_transition(self, start, stop):
+        """Compute the way of doing a R7 transition and validate it
+
+        Returns
+        -------
+            A TransitionResult (without delta), or None if start == stop
+        """
+        try:
+            return self._compute_r7_transition(start, stop)
+        finally:
+            self._sink.flush()
+
+    def _compute_r7_transition(self, start, stop):
         """Compute the way of doing a R7 transition and validate it"""
 
         # Configure start
         if start != self._crtc._registers[7]:
             self._crtc.set_register(7, start)
             self._crtc.rest_internal_counters()
+        self._frame_length = self.get_frame_length()
+        registers = self.get_registers()
+
+        result = self._get_cached_transition(7, start, stop, registers)
+        if result is not None:
+            return result
 
+        begin = len(self._source_code)
         if stop > start:
             self._compute_r7_transition_increase( start, stop)
         elif stop < start:
             self._compute_r7_transition_decrease( start, stop)
         else:
             "Ugh?"
+            return None
+
+        result = TransitionResult(delta=None,
+                                  source=self._source_code[begin:],
+                                  nops=self._frame_length)
+        self._store_transition(7, start, stop, registers, result)
+        return result
 
     def _compute_r7_transition_decrease(self, start, stop):
         """Compute transition when we increase R7 value"""
 
-        print 'Screen during transition'
+        self._sink.text('Screen during transition\n')
 
         self._source_code += """
  ; Transition from R7=%d to R7=%d
@@ -649,9 +1259,7 @@ class TransitionHelper(object):
     halt
 """
 
-            while not self._crtc._ga.is_int_raised():
-                self._crtc.print_state_per_char_line()
-                self._crtc.execute()
+            self._crtc.run_until_next_interrupt(_print=True)
             self._crtc._ga._int_raised = False
 
 
@@ -660,8 +1268,8 @@ class TransitionHelper(object):
     call secure_wait_vsync
 """
 
-        assert self._crtc.get_nops() == 64*39*8
-        print 'Transition done in %d nops' % self._crtc.get_nops()
+        assert self._crtc.get_nops() == self._frame_length
+        self._sink.text('Transition done in %d nops\n' % self._crtc.get_nops())
 
 
         # Reset R4
@@ -670,11 +1278,11 @@ class TransitionHelper(object):
 
 
 
-        print 'Screen after transition'
+        self._sink.text('Screen after transition\n')
         self._crtc.print_configuration()
 
-        print 'Source code'
-        print self._source_code
+        self._sink.text('Source code\n')
+        self._sink.text(self._source_code + '\n')
 
 
 
@@ -683,7 +1291,7 @@ class TransitionHelper(object):
     def _compute_r7_transition_increase(self, start, stop):
         """Compute transition when we decrease R7 value"""
 
-        print 'Screen during transition'
+        self._sink.text('Screen during transition\n')
 
         self._source_code += """
  ; Transition from R7=%d to R7=%d
@@ -712,9 +1320,7 @@ class TransitionHelper(object):
     halt
 """
 
-            while not self._crtc._ga.is_int_raised():
-                self._crtc.print_state_per_char_line()
-                self._crtc.execute()
+            self._crtc.run_until_next_interrupt(_print=True)
             self._crtc._ga._int_raised = False
 
 
@@ -727,16 +1333,146 @@ class TransitionHelper(object):
         self._crtc.run_until_next_vsync(_print=True)
         self._crtc.print_horizontal_bottom_rule()
 
-        print 'Transition done in %d nops' % self._crtc.get_nops()
-        assert self._crtc.get_nops() == 64*39*8
+        self._sink.text('Transition done in %d nops\n' % self._crtc.get_nops())
+        assert self._crtc.get_nops() == self._frame_length
 
-        print 'Screen after transition'
+        self._sink.text('Screen after transition\n')
         self._crtc.print_configuration()
 
-        print 'Source code'
-        print self._source_code
+        self._sink.text('Source code\n')
+        self._sink.text(self._source_code + '\n')
+
+
+
+
+def _solve_r2_transition(transition):
+    """Solve a R2 transition without printing anything.
+
+    Parameters
+    ----------
+        - transition: tuple
+            (start, stop) values of R2
+
+    Returns
+    -------
+        (start, stop, delta, source, nops) with None values if not solved
+    """
+    start, stop = transition
+    result = TransitionHelper(verbose=False).compute_r2_transition(start, stop)
+    if result is None:
+        return start, stop, None, None, None
+    return (start, stop) + tuple(result)
+
+def _get_r2_transition_registers(start):
+    """Return the register values before a R2 transition from start."""
+    helper = TransitionHelper(verbose=False)
+    helper._configure_r2_start(start)
+    return helper.get_registers()
+
+def compute_r2_transition_table(values=range(10, 64), processes=None,
+        cache=None):
+    """Solve the R2 transitions between all the values using a pool of
+    processes.
+
+    Parameters
+    ----------
+        - values: list
+            Values of R2 to go from and to
+        - processes: int
+            Number of processes to use (number of cpus if None)
+        - cache: TransitionCache
+            if not None, only the transitions missing in the cache are
+            solved, and then stored in it
+
+    Returns
+    -------
+        list of (start, stop, delta, source, nops)
+    """
+    transitions = [(start, stop) for start in values for stop in values
+                   if start != stop]
+
+    # Get the already solved transitions
+    solved = {}
+    if cache is not None:
+        registers = dict((start, _get_r2_transition_registers(start))
+                         for start in values)
+        for start, stop in transitions:
+            result = cache.get(2, start, stop, registers[start])
+            if result is not None:
+                solved[start, stop] = (start, stop) + tuple(result)
+
+    missing = [_ for _ in transitions if _ not in solved]
+    if missing:
+        pool = multiprocessing.Pool(processes)
+        try:
+            rows = pool.map(_solve_r2_transition, missing, chunksize=8)
+        finally:
+            pool.close()
+            pool.join()
+
+        for row in rows:
+            solved[row[0], row[1]] = row
+
+        if cache is not None:
+            for start, stop, delta, source, nops in rows:
+                if source is not None:
+                    cache.store(2, start, stop, registers[start],
+                            TransitionResult(delta, source, nops))
+            cache.save()
+
+    return [solved[_] for _ in transitions]
+
+def write_r2_transition_table(table, fname):
+    """Write the transitions of the table in one include file.
+    Each transition is preceded by the label r2_transition_<start>_<stop>.
+
+    Parameters
+    ----------
+        - table: list
+            Result of compute_r2_transition_table
+        - fname: str
+            Name of the file to write
+    """
+    f = open(fname, 'w')
+    f.write(" ; Generated source by crtc_transition_helper.py\n")
+    f.write(" ; (Krusty/Benediction (c) 2011\n\n")
+
+    for start, stop, delta, source, nops in table:
+        if source is None:
+            f.write(" ; Transition from R2=%d to R2=%d not solved\n\n" % \
+                    (start, stop))
+            continue
+
+        f.write("r2_transition_%d_%d\n" % (start, stop))
+        f.write(" ; delta=%d, frame of %d nops\n" % (delta, nops))
+        f.write(source)
+        f.write("\n")
+
+    f.close()
 
 
+def bench_crtc(nb_frames=20):
+    """Print the emulation speed (in nops per second) of the CRTC
+    implementations, step by step and with fast forward.
+
+    Parameters
+    ----------
+        - nb_frames: int
+            Number of frames to emulate with each implementation
+    """
+    for name, crtc in (('SimpleCRTC', SimpleCRTC(fast_forward=False)),
+                       ('FastCRTC', FastCRTC(fast_forward=False)),
+                       ('SimpleCRTC fast forward', SimpleCRTC()),
+                       ('FastCRTC fast forward', FastCRTC())):
+        crtc.run_until_next_vsync()
+        crtc.reset_nops()
+
+        begin = time.time()
+        for i in range(nb_frames):
+            crtc.run_until_next_vsync()
+        duration = time.time() - begin
+
+        print '%-24s %12d nops/s' % (name, crtc.get_nops() / duration)
 
 
 def test_crtc():
@@ -744,6 +1480,110 @@ def test_crtc():
     crtc.print_configuration()
 
 
+def _get_random_registers(random):
+    """Return random timing registers (R0, R2, R3, R4, R7, R9), including
+    HSYNC crossing lines or missing, and VSYNC out of the frame."""
+    R0 = random.choice((random.randint(10, 63), 63))
+    R4 = random.randint(1, 38)
+    return {0: R0,
+            2: random.choice((random.randint(0, R0 + 2), R0 - 2, 46)),
+            3: random.choice((random.randint(0, 255), 0x8e, 0x80)),
+            4: R4,
+            7: random.choice((random.randint(0, R4 + 2), 0, R4 + 1)),
+            9: random.randint(0, 7)}
+
+
+def test_fast_forward():
+    """Compare the fast forward with the nop by nop execution"""
+    import random
+    random = random.Random(1)
+
+    for registers in range(50):
+        step = SimpleCRTC(fast_forward=False)
+        fast = SimpleCRTC(fast_forward=True)
+        values = _get_random_registers(random)
+        for crtc in (step, fast):
+            for register, value in values.items():
+                crtc.set_register(register, value)
+
+        for change in range(4):
+            # Registers are also changed in the middle of lines and HSYNC
+            if change:
+                register, value = random.choice(
+                        _get_random_registers(random).items())
+                step.set_register(register, value)
+                fast.set_register(register, value)
+
+            n = random.randint(1, 20000)
+            step.execute_n_nops(n, False)
+            fast.execute_n_nops(n, False)
+            assert step.snapshot() == fast.snapshot(), step.get_registers()
+
+
+def test_frame_timing():
+    """Compare the closed form frame timings with the emulation"""
+    import random
+    random = random.Random(2)
+
+    for registers in range(1000):
+        R0 = random.randint(16, 63)
+        width = random.randint(1, 15)
+        R4 = random.randint(1, 38)
+        registers = SimpleCRTC().get_registers()
+        registers[0] = R0
+        registers[2] = random.choice((1, R0 + 1 - width,
+                                      random.randint(1, R0 + 1 - width)))
+        registers[3] = random.randint(0, 15) << 4 | width
+        registers[4] = R4
+        registers[7] = random.choice((1, R4 + 1, random.randint(1, R4 + 1)))
+        registers[9] = random.randint(0, 7)
+
+        timing = compute_frame_timing(registers)
+        if (registers[9] + 1) * (R4 + 1) >= 16:
+            assert timing.closed_form
+        assert timing[:-1] == _emulate_frame_timing(registers)[:-1], registers
+
+
+def test_fast_crtc():
+    """Compare FastCRTC with SimpleCRTC nop by nop, with register changes"""
+    import random
+    random = random.Random(0)
+
+    simple = SimpleCRTC(fast_forward=False)
+    fast = FastCRTC(fast_forward=False)
+    for crtc in (simple, fast):
+        try:
+            crtc.foo = 1
+            assert False, 'Attributes must be in slots'
+        except AttributeError:
+            pass
+
+    for change in range(200):
+        register = random.choice((0, 2, 3, 4, 7, 9))
+        value = {0: random.randint(20, 63),
+                 2: random.randint(0, 65),
+                 3: random.randint(0, 255),
+                 4: random.randint(4, 38),
+                 7: random.randint(0, 40),
+                 9: random.randint(0, 7)}[register]
+        for crtc in (simple, fast):
+            crtc.set_register(register, value)
+
+        for nop in range(random.randint(1, 3000)):
+            simple.execute()
+            fast.execute()
+            assert simple.snapshot() == fast.snapshot()
+            assert simple.is_VSync_start() == fast.is_VSync_start()
+            assert simple.is_int_raised() == fast.is_int_raised()
+
+    state = simple.snapshot()
+    fast.restore(state)
+    simple.restore(state)
+    simple.execute_n_nops(5000, False)
+    fast.execute_n_nops(5000, False)
+    assert simple.snapshot() == fast.snapshot()
+
+
 def test_transition1():
     """Test a transition with increasing R7"""
     print """Test a transition with increasing R7"""
@@ -773,20 +1613,55 @@ if __name__ == "__main__":
     #test_transitiona()
 
     parser = argparse.ArgumentParser(description='Compute CRTC transitions.')
-    parser.add_argument('--begin', '-b', type=int, required=True,
+    parser.add_argument('--begin', '-b', type=int,
                    help='Initial value for the register')
-    parser.add_argument('--end', '-e', type=int,required=True,
+    parser.add_argument('--end', '-e', type=int,
                    help='Final value for the register')
 
-    parser.add_argument('--register', '-r', type=int, choices=(2,7),required=True,
+    parser.add_argument('--register', '-r', type=int, choices=(2,7),
                    help='Register to treat (7 or 2)')
 
+    parser.add_argument('--r2-table', metavar='FNAME',
+                   help='Write all the R2 transitions from 10 to 63 in FNAME')
+    parser.add_argument('--jobs', '-j', type=int,
+                   help='Number of processes for --r2-table (default: all cpus)')
+    parser.add_argument('--cache', '-c', metavar='FNAME',
+                   help='Json file caching the solved transitions')
+
+    parser.add_argument('--trace', '-t', metavar='FNAME',
+                   help='Write a binary trace in FNAME instead of printing')
+    parser.add_argument('--bench', action='store_true',
+                   help='Print the emulation speed of the CRTC')
+
     args = parser.parse_args()
 
-    helper = TransitionHelper()
+    if args.bench:
+        bench_crtc()
+        sys.exit(0)
+
+    cache = None
+    if args.cache:
+        cache = TransitionCache(args.cache)
+
+    if args.r2_table:
+        table = compute_r2_transition_table(processes=args.jobs, cache=cache)
+        write_r2_transition_table(table, args.r2_table)
+        sys.exit(0)
+
+    if args.begin is None or args.end is None or args.register is None:
+        parser.error('--begin, --end and --register are required')
+
+    sink = None
+    if args.trace:
+        sink = BinaryTraceSink(args.trace)
+
+    helper = TransitionHelper(cache=cache, sink=sink)
     if args.register == 7:
         helper.compute_r7_transition(args.begin, args.end)
     elif args.register == 2:
         helper.compute_r2_transition(args.begin, args.end)
     else:
         print args
+
+    if sink is not None:
+        sink.close()
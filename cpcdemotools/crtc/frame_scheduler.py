@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Multi-frame scheduler.
+
+Run the CRTC and the GA during several frames while writing registers at given
+nop offsets, as the code of a rasters or splitscreens effect does, and report
+the stability of each frame.
+
+Frames are the slices of frame_nops nops of the Z80 code, the first one
+starting at the beginning of the VSYNC of a stable frame. A stable frame
+starts its VSYNC at its first nop and lasts frame_nops nops.
+"""
+
+# imports
+import collections
+import sys
+
+try:
+    from cpcdemotools.crtc.crtc_transitions_helper import \
+            compute_frame_timing, FastCRTC, OUT_NOPS
+    from cpcdemotools.crtc.trace_sinks import NullTraceSink
+except ImportError:
+    # Run from the source tree
+    from crtc_transitions_helper import compute_frame_timing, FastCRTC, \
+            OUT_NOPS
+    from trace_sinks import NullTraceSink
+
+# code
+
+RegisterEvent = collections.namedtuple('RegisterEvent', [
+    'frame',            # Index of the frame
+    'nop',              # Nops since the beginning of the frame
+    'register',         # Written register
+    'value',            # Written value
+    ])
+
+FrameReport = collections.namedtuple('FrameReport', [
+    'frame',            # Index of the frame
+    'length',           # Nops since the previous VSYNC start (None if unknown)
+    'vsyncs',           # Nops of the frame where a VSYNC starts
+    'interrupts',       # Nops of the frame where the GA raises an interrupt
+    'stable',           # True if the frame is in sync with the monitor
+    ])
+
+
+class FrameScheduler(object):
+    """Execute register writes over several frames."""
+
+    def __init__(self, registers, frame_nops=None):
+        """Initialise the scheduler.
+
+        Parameters
+        ----------
+            - registers: list
+                Values of the CRTC registers before the first frame
+            - frame_nops: int
+                Duration of a frame of the Z80 code (the length of a stable
+                frame with registers by default)
+        """
+        self._registers = list(registers)
+        if frame_nops is None:
+            frame_nops = compute_frame_timing(registers).frame_length
+        self._frame_nops = frame_nops
+        self._crtc = FastCRTC(sink=NullTraceSink())
+
+    def run(self, events, nb_frames):
+        """Execute the frames.
+
+        Parameters
+        ----------
+            - events: list
+                RegisterEvent sorted by frame and nop. The register is written
+                once the nop of the event has been executed
+            - nb_frames: int
+                Number of frames to execute
+
+        Returns
+        -------
+            List of FrameReport
+        """
+        frame_nops = self._frame_nops
+        crtc = self._crtc
+        crtc.rest_internal_counters()
+        for register, value in enumerate(self._registers):
+            crtc.set_register(register, value)
+        crtc.run_until_next_vsync()
+        crtc.run_until_next_vsync()
+        crtc.reset_nops()
+
+        vsyncs = [[] for frame in range(nb_frames)]
+        interrupts = [[] for frame in range(nb_frames)]
+        vsyncs[0].append(0)
+        if crtc.is_int_raised():
+            interrupts[0].append(0)
+
+        end = nb_frames * frame_nops
+        previous = None
+        for event in list(events) + [RegisterEvent(nb_frames, 0, None, None)]:
+            if event.nop < 0 or event.nop >= frame_nops:
+                raise ValueError('Event %s out of its frame' % (event,))
+            if previous is not None and event[:2] < previous[:2]:
+                raise ValueError('Event %s is not sorted' % (event,))
+            previous = event
+
+            date = min(event.frame * frame_nops + event.nop, end)
+            while crtc.get_nops() < date:
+                crtc.run_until_next_event(date - crtc.get_nops())
+                now = crtc.get_nops()
+                if now == end:
+                    break
+                if crtc.is_VSync_start():
+                    vsyncs[now // frame_nops].append(now % frame_nops)
+                if crtc.is_int_raised():
+                    interrupts[now // frame_nops].append(now % frame_nops)
+
+            if event.register is not None and date < end:
+                crtc.set_register(event.register, event.value)
+
+        return self._get_reports(vsyncs, interrupts)
+
+    def _get_reports(self, vsyncs, interrupts):
+        """Build the reports of the frames from the recorded positions."""
+        frame_nops = self._frame_nops
+        reports = []
+        last_vsync = 0
+        for frame in range(len(vsyncs)):
+            length = None
+            for nop in vsyncs[frame]:
+                date = frame * frame_nops + nop
+                if date:
+                    length = date - last_vsync
+                last_vsync = date
+            if frame == 0:
+                length = None
+
+            reports.append(FrameReport(frame=frame,
+                                       length=length,
+                                       vsyncs=vsyncs[frame],
+                                       interrupts=interrupts[frame],
+                                       stable=vsyncs[frame] == [0] and
+                                              length in (None, frame_nops)))
+        return reports
+
+
+def get_plan_events(plan, frame, nop=0):
+    """Convert a plan of TransitionPlanner to events.
+
+    Parameters
+    ----------
+        - plan: list
+            PlanStep of the transition
+        - frame: int
+            Frame of the transition
+        - nop: int
+            Nop of the frame where the plan starts
+
+    Returns
+    -------
+        List of RegisterEvent
+    """
+    events = []
+    for step in plan:
+        nop = nop + step.wait + OUT_NOPS
+        events.append(RegisterEvent(frame, nop, step.register, step.value))
+    return events
+
+
+if __name__ == '__main__':
+    registers = [63, 40, 46, 0x8e, 38, 0, 25, 30, 0, 7, 0, 0, 0x30, 0x00]
+    scheduler = FrameScheduler(registers)
+
+    # Splitscreen: another screen address from the middle of the screen,
+    # the upper part restored during the VSYNC
+    events = []
+    for frame in range(50):
+        events.extend([RegisterEvent(frame, 100, 12, 0x30),
+                       RegisterEvent(frame, 12000, 12, 0x20)])
+
+    # R4 breaks the frames from the 40th one: the VSYNC comes later
+    events.append(RegisterEvent(40, 1000, 4, 45))
+    events.sort()
+
+    for report in scheduler.run(events, 50):
+        sys.stdout.write('%2d %s %-6s vsyncs: %s interrupts: %s\n' % (
+            report.frame, 'stable  ' if report.stable else 'UNSTABLE',
+            report.length, report.vsyncs, report.interrupts))
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
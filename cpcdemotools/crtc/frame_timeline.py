@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Frame timeline.
+
+Build the state of the CRTC and the GA at each nop of a stable frame as NumPy
+arrays, in order to analyse or display a whole frame from code.
+"""
+
+# imports
+import collections
+import sys
+
+import numpy as np
+
+try:
+    from cpcdemotools.crtc.crtc_transitions_helper import \
+            compute_frame_timing, FastCRTC
+except ImportError:
+    # Run from the source tree
+    from crtc_transitions_helper import compute_frame_timing, FastCRTC
+
+# code
+
+# Number of lines of the VSYNC in SimpleCRTC (R3 high quartet is ignored)
+VSYNC_WIDTH = 16
+
+FrameTimeline = collections.namedtuple('FrameTimeline', [
+    'HCC',              # Horizontal char counter
+    'VCC',              # Vertical char counter
+    'VLC',              # Vertical line counter
+    'hsync',            # True during HSYNC
+    'vsync',            # True during VSYNC
+    'border',           # True in the border
+    'interrupt',        # True when the GA has just raised an interrupt
+    ])
+
+
+def compute_frame_timeline(registers):
+    """Compute the state of the CRTC at each nop of a stable frame.
+
+    Index k of each array is the state after k nops from the beginning of the
+    frame (HCC, VLC and VCC at 0), i.e. the state displayed by
+    SimpleCRTC.print_state before executing the next nop.
+    Register sets solved in closed form by compute_frame_timing are built
+    with array operations, the others are emulated.
+
+    Parameters
+    ----------
+        - registers: list
+            Values of the CRTC registers (at least R0 to R9)
+
+    Returns
+    -------
+        A FrameTimeline
+    """
+    timing = compute_frame_timing(registers)
+    if not timing.closed_form:
+        return _emulate_frame_timeline(registers, timing.frame_length)
+
+    R0, R1, R6, R9 = [registers[_] for _ in (0, 1, 6, 9)]
+    line_length = R0 + 1
+    frame_length = timing.frame_length
+    nb_lines = frame_length // line_length
+
+    nops = np.arange(frame_length)
+    lines = nops // line_length
+    HCC = nops % line_length
+    VLC = lines % (R9 + 1)
+    VCC = lines // (R9 + 1)
+
+    hsync = (HCC >= timing.hsync_start) & (HCC < timing.hsync_stop)
+
+    vsync_line = timing.vsync_start // line_length
+    vsync = (lines - vsync_line) % nb_lines < VSYNC_WIDTH
+
+    interrupt = np.zeros(frame_length, dtype=bool)
+    interrupt[np.array(timing.interrupts, dtype=int) % frame_length] = True
+
+    return FrameTimeline(HCC=HCC.astype(np.uint8),
+                         VCC=VCC.astype(np.uint8),
+                         VLC=VLC.astype(np.uint8),
+                         hsync=hsync,
+                         vsync=vsync,
+                         border=(HCC >= R1) | (VCC >= R6),
+                         interrupt=interrupt)
+
+
+def _emulate_frame_timeline(registers, frame_length):
+    """Build the timeline of the frame following two synchronisation frames
+    with FastCRTC."""
+    crtc = FastCRTC()
+    for register, value in enumerate(registers):
+        crtc.set_register(register, value)
+    crtc.fast_forward(2 * frame_length)
+
+    states = np.zeros((frame_length, 6), dtype=np.uint8)
+    for k in range(frame_length):
+        states[k] = (crtc.get_HCC(), crtc.get_VCC(), crtc.get_VLC(),
+                     crtc.is_HSync(), crtc.is_VSync(),
+                     crtc.is_int_raised())
+        crtc.execute()
+
+    HCC, VCC = states[:, 0], states[:, 1]
+    return FrameTimeline(HCC=HCC,
+                         VCC=VCC,
+                         VLC=states[:, 2],
+                         hsync=states[:, 3].astype(bool),
+                         vsync=states[:, 4].astype(bool),
+                         border=(HCC >= registers[1]) | (VCC >= registers[6]),
+                         interrupt=states[:, 5].astype(bool))
+
+
+def get_state_characters(timeline):
+    """Return the character used by SimpleCRTC.print_state for each nop
+    (H for HSYNC, V for VSYNC, B for border and C for content).
+
+    Parameters
+    ----------
+        - timeline: FrameTimeline
+            Timeline of the frame
+
+    Returns
+    -------
+        Array of single characters
+    """
+    return np.where(timeline.hsync, 'H',
+            np.where(timeline.vsync, 'V',
+                np.where(timeline.border, 'B', 'C')))
+
+
+if __name__ == '__main__':
+    registers = [63, 40, 46, 0x8e, 38, 0, 25, 30, 0, 7]
+    timeline = compute_frame_timeline(registers)
+    characters = get_state_characters(timeline)
+
+    # One line per char line, as SimpleCRTC.print_configuration
+    first_lines = (timeline.VLC == 0) & (timeline.HCC == 0)
+    for start in np.flatnonzero(first_lines):
+        sys.stdout.write('%02d %s\n' % (timeline.VCC[start],
+            ''.join(characters[start:start + registers[0] + 1])))
+    print '%d nops, interrupts at %s' % (len(characters),
+            list(np.flatnonzero(timeline.interrupt)))
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
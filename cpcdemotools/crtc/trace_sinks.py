@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Trace sinks.
+
+Destinations of the CRTC traces (states of the CRTC at each nop, rules,
+messages) produced by SimpleCRTC and TransitionHelper.
+Sinks buffer what they receive and only write it when flushed.
+"""
+
+# imports
+import sys
+
+# code
+
+class NullTraceSink(object):
+    """Sink ignoring everything.
+    Emulation is not traced at all when the sink is not enabled.
+    """
+
+    enabled = False
+
+    def state(self, crtc):
+        """Trace the state of the CRTC for the current nop."""
+        pass
+
+    def text(self, string):
+        """Trace a message, a rule..."""
+        pass
+
+    def flush(self):
+        """Write what has been traced since the last flush."""
+        pass
+
+    def close(self):
+        """Flush and release the sink."""
+        self.flush()
+
+
+class TextTraceSink(NullTraceSink):
+    """Sink rendering the trace as text.
+    Each nop is displayed as one character: H for HSYNC, V for VSYNC, B for
+    border and C for content.
+    """
+
+    enabled = True
+
+    def __init__(self, stream=None):
+        """Initialise the sink.
+
+        Parameters
+        ----------
+            - stream: file
+                Stream to write into (sys.stdout if None)
+        """
+        self._stream = stream
+        self._buffer = []
+
+    def state(self, crtc):
+        """Trace the state of the CRTC for the current nop."""
+        buffer = self._buffer
+
+        if crtc.get_HCC() == 0:
+            if crtc.get_VCC() == crtc.R6():
+                buffer.append(' R6')
+            elif crtc.get_VCC() == crtc.R7():
+                buffer.append(' R7')
+
+            buffer.append("\n%02d " % crtc.get_VCC())
+
+        if crtc.is_HSync():
+            buffer.append('H')
+        elif crtc.is_VSync():
+            buffer.append('V')
+        elif crtc.is_border():
+            buffer.append('B')
+        else:
+            buffer.append('C')
+
+    def text(self, string):
+        """Trace a message, a rule..."""
+        self._buffer.append(string)
+
+    def flush(self):
+        """Write what has been traced since the last flush."""
+        if not self._buffer:
+            return
+
+        stream = self._stream if self._stream is not None else sys.stdout
+        stream.write(''.join(self._buffer))
+        stream.flush()
+        self._buffer = []
+
+
+class BinaryTraceSink(NullTraceSink):
+    """Sink writing a compact binary trace in a file.
+    Each nop is stored in 4 bytes: HCC, VCC, VLC and flags (see the *_FLAG
+    constants). Texts are ignored.
+    """
+
+    enabled = True
+
+    HSYNC_FLAG = 1
+    VSYNC_FLAG = 2
+    BORDER_FLAG = 4
+    INTERRUPT_FLAG = 8
+
+    def __init__(self, fname):
+        """Initialise the sink.
+
+        Parameters
+        ----------
+            - fname: str
+                Name of the trace file (overwritten)
+        """
+        self._file = open(fname, 'wb')
+        self._buffer = bytearray()
+
+    def state(self, crtc):
+        """Trace the state of the CRTC for the current nop."""
+        flags = 0
+        if crtc.is_HSync():
+            flags = flags | self.HSYNC_FLAG
+        if crtc.is_VSync():
+            flags = flags | self.VSYNC_FLAG
+        if crtc.is_border():
+            flags = flags | self.BORDER_FLAG
+        if crtc.is_int_raised():
+            flags = flags | self.INTERRUPT_FLAG
+
+        self._buffer.extend((crtc.get_HCC() & 0xff, crtc.get_VCC() & 0xff,
+                             crtc.get_VLC() & 0xff, flags))
+
+    def flush(self):
+        """Write what has been traced since the last flush."""
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer = bytearray()
+
+    def close(self):
+        """Flush and close the trace file."""
+        self.flush()
+        self._file.close()
+
+
+def read_binary_trace(fname):
+    """Read a trace written by BinaryTraceSink.
+
+    Parameters
+    ----------
+        - fname: str
+            Name of the trace file
+
+    Returns
+    -------
+        NumPy array of shape (nb_nops, 4): HCC, VCC, VLC and flags
+    """
+    import numpy as np
+    return np.fromfile(fname, dtype=np.uint8).reshape(-1, 4)
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
@@ -0,0 +1,379 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Multi-register transition planner.
+
+Search the OUT sequences (and the padding nops between them) which change
+several CRTC registers during one frame while keeping the frame (from VSYNC to
+VSYNC) at a target number of nops, so the monitor stays synchronised.
+
+The plan starts at the beginning of the VSYNC of a stable frame. Each step
+waits some nops, then writes one register with:
+
+    ld bc, 0xbc00 + register   ; 3 nops
+    out (c), c                 ; 4 nops
+    ld bc, 0xbd00 + value      ; 3 nops
+    out (c), c                 ; 4 nops
+
+The value is considered to be written at the end of the sequence.
+"""
+
+# imports
+import collections
+import sys
+
+try:
+    from cpcdemotools.crtc.crtc_transitions_helper import \
+            compute_frame_timing, FastCRTC, OUT_NOPS
+    from cpcdemotools.crtc.trace_sinks import NullTraceSink
+except ImportError:
+    # Run from the source tree
+    from crtc_transitions_helper import compute_frame_timing, FastCRTC, \
+            OUT_NOPS
+    from trace_sinks import NullTraceSink
+
+# code
+
+# Registers which modify the length of the frame or the position of the VSYNC
+TIMING_REGISTERS = (0, 4, 7, 9)
+
+# Registers without effect on the timings of SimpleCRTC, written at once
+DISPLAY_REGISTERS = (1, 6, 12, 13)
+
+# Registers which change for one line to compensate the length of the frame
+COMPENSATION_REGISTER = 0
+
+PlanStep = collections.namedtuple('PlanStep', [
+    'wait',             # Number of nops to wait before the OUT sequence
+    'register',         # Written register
+    'value',            # Written value
+    ])
+
+
+class TransitionPlanner(object):
+    """Plan the change of a register set to another one in one frame.
+
+    The search is a depth first search over the order of the writes of the
+    timing registers and the line where each of them happens. Only the first
+    line where a write has a new effect is tried (the char line for R4 and R7,
+    the line for R0 and R9), states already explored are memoized, and the
+    remaining difference with the target length is absorbed by changing R0
+    during some lines.
+    """
+
+    def __init__(self, max_outs=8):
+        """Initialise the planner.
+
+        Parameters
+        ----------
+            - max_outs: int
+                Maximum number of OUT sequences of a plan
+        """
+        self._max_outs = max_outs
+        self._plans = {}
+        self._crtc = FastCRTC(sink=NullTraceSink())
+
+    def plan(self, start, stop, target_nops=None):
+        """Find the shortest plan from start registers to stop registers.
+
+        Parameters
+        ----------
+            - start: list
+                Values of the registers (R0 to R13 at least) of the stable
+                frame before the transition
+            - stop: list
+                Values of the registers after the transition
+            - target_nops: int
+                Length of the transition frame (by default the length of a
+                stable frame with the stop registers)
+
+        Returns
+        -------
+            A list of PlanStep (the fewest OUT sequences, then the fewest
+            padding nops), or None if there is no plan within max_outs
+        """
+        start, stop = tuple(start), tuple(stop)
+        if len(start) != len(stop):
+            raise ValueError('start and stop register sets differ in size')
+        changed = [register for register in range(len(stop))
+                   if start[register] != stop[register]]
+        for register in changed:
+            if register not in TIMING_REGISTERS + DISPLAY_REGISTERS:
+                raise ValueError('R%d transitions are not handled by the '
+                                 'planner' % register)
+        if target_nops is None:
+            target_nops = compute_frame_timing(stop).frame_length
+
+        key = (start, stop, target_nops)
+        if key not in self._plans:
+            self._plans[key] = self._search_plan(start, stop, target_nops,
+                                                 changed)
+        return self._plans[key]
+
+    def check(self, start, plan):
+        """Execute a plan from the beginning of the VSYNC of a stable frame.
+
+        Parameters
+        ----------
+            - start: list
+                Values of the registers before the transition
+            - plan: list
+                PlanStep to execute
+
+        Returns
+        -------
+            (Length of the transition frame, length of the next frame,
+            registers at the end of the transition)
+        """
+        crtc = self._crtc
+        self._synchronize(start)
+        for step in plan:
+            self._execute_step(step)
+        crtc.run_until_next_vsync()
+        transition_nops = crtc.get_nops()
+        crtc.reset_nops()
+        crtc.run_until_next_vsync()
+        return transition_nops, crtc.get_nops(), crtc.get_registers()
+
+    def _synchronize(self, registers):
+        """Place the CRTC at the beginning of the VSYNC of a stable frame."""
+        crtc = self._crtc
+        crtc.rest_internal_counters()
+        for register, value in enumerate(registers):
+            crtc.set_register(register, value)
+        crtc.run_until_next_vsync()
+        crtc.run_until_next_vsync()
+        crtc.reset_nops()
+
+    def _execute_step(self, step):
+        """Execute the nops of a step then write its register."""
+        self._crtc.fast_forward(step.wait + OUT_NOPS)
+        self._crtc.set_register(step.register, step.value)
+
+    def _search_plan(self, start, stop, target_nops, changed):
+        """Search a plan not already memoized."""
+        self._synchronize(start)
+
+        # Display registers first, they have no effect on the timings
+        plan = [PlanStep(0, register, stop[register])
+                for register in changed if register in DISPLAY_REGISTERS]
+        for step in plan:
+            self._execute_step(step)
+
+        self._stop = stop
+        self._target_nops = target_nops
+        self._min_outs = len(changed)
+        self._best = None
+        self._explored = set()
+        self._line_starts = {}
+        self._vsync_delays = {}
+        self._search(plan, [register for register in changed
+                            if register in TIMING_REGISTERS])
+        return self._best
+
+    def _get_cost(self, plan):
+        """Return the cost of a plan (number of OUT, then padding nops)."""
+        return len(plan), sum(step.wait for step in plan)
+
+    def _search(self, plan, remaining):
+        """Try all the orders and lines for the remaining writes."""
+        if self._best is not None and len(self._best) == self._min_outs:
+            return
+        if len(plan) + len(remaining) > self._max_outs:
+            return
+        if not remaining:
+            self._evaluate(plan)
+            return
+
+        crtc = self._crtc
+        state = crtc.snapshot()
+        key = (state[:-1], tuple(remaining))
+        if key in self._explored:
+            return
+        self._explored.add(key)
+
+        for register in remaining:
+            others = [_ for _ in remaining if _ != register]
+            # The waits increase: start each try from the previous one
+            cursor, previous_wait = state, 0
+            for wait in self._get_waits(register, len(others)):
+                crtc.restore(cursor)
+                crtc.fast_forward(wait - previous_wait)
+                cursor, previous_wait = crtc.snapshot(), wait
+
+                step = PlanStep(wait, register, self._stop[register])
+                crtc.fast_forward(OUT_NOPS)
+                crtc.set_register(register, step.value)
+                self._search(plan + [step], others)
+        crtc.restore(state)
+
+    def _get_waits(self, register, nb_others):
+        """Return the waits to try before writing register.
+
+        A wait of 0 is always tried, then the waits which start the OUT
+        sequence at the beginning of the lines where the write has a
+        different effect than on the previous one, until the end of the
+        frame.
+        """
+        value = self._stop[register]
+        limit = self._target_nops - (nb_others + 1) * OUT_NOPS - \
+                self._crtc.get_nops()
+
+        waits = [0]
+        for wait, VLC in self._get_line_starts():
+            if wait > limit:
+                break
+            if register in (4, 7) and VLC != 0:
+                continue
+            if register == 9 and 0 < VLC < value:
+                continue
+            if wait != waits[-1]:
+                waits.append(wait)
+        return waits
+
+    def _get_line_starts(self):
+        """Return the (nops from now, VLC) of the beginning of the lines
+        until the next VSYNC.
+        States are memoized without their nop counters: the lines following
+        a write in the same line of different plans are the same."""
+        crtc = self._crtc
+        state = crtc.snapshot()
+        key = state[:-2]
+        if key not in self._line_starts:
+            now = crtc.get_nops()
+            line_starts = []
+            while crtc.get_nops() - now <= self._target_nops:
+                crtc.run_until_next_line()
+                if crtc.is_VSync_start():
+                    break
+                line_starts.append((crtc.get_nops() - now, crtc.get_VLC()))
+            self._line_starts[key] = line_starts
+            crtc.restore(state)
+        return self._line_starts[key]
+
+    def _get_vsync_delay(self):
+        """Return the number of nops until the next VSYNC (memoized as
+        _get_line_starts)."""
+        crtc = self._crtc
+        state = crtc.snapshot()
+        key = state[:-2]
+        if key not in self._vsync_delays:
+            crtc.run_until_next_vsync()
+            self._vsync_delays[key] = crtc.get_nops() - state[-2]
+            crtc.restore(state)
+        return self._vsync_delays[key]
+
+    def _evaluate(self, plan):
+        """Measure the frame once every register is written and keep the
+        plan (with its compensation) if it is the best one."""
+        crtc = self._crtc
+        delta = self._target_nops - crtc.get_nops() - self._get_vsync_delay()
+        if delta != 0:
+            state = crtc.snapshot()
+            plan = self._compensate(plan, delta)
+            crtc.restore(state)
+        if plan is None:
+            return
+        if self._best is None or \
+                self._get_cost(plan) < self._get_cost(self._best):
+            self._best = plan
+
+    def _compensate(self, plan, delta):
+        """Absorb delta nops by changing R0 during some lines.
+
+        Each compensated line costs two OUT sequences: one at the beginning
+        of the line with a new R0 value, one at the beginning of the next line
+        to restore R0.
+
+        Returns
+        -------
+            The completed plan, or None if the frame cannot reach its target
+        """
+        crtc = self._crtc
+        register = COMPENSATION_REGISTER
+        restored = self._stop[register]
+
+        # Give up early when the compensation needs too many lines
+        if delta > 0:
+            nb_lines = -(-delta // (255 - restored)) if restored < 255 else 0
+        else:
+            nb_lines = -(delta // (restored - OUT_NOPS)) \
+                    if restored > OUT_NOPS else 0
+        nb_outs = len(plan) + 2 * nb_lines
+        if nb_lines == 0 or nb_outs > self._max_outs or \
+                (self._best is not None and nb_outs > len(self._best)):
+            return None
+
+        plan = list(plan)
+        while delta != 0:
+            # The line ends at HCC == value + 1 only if the write happens
+            # before HCC reaches value
+            value = min(max(restored + delta, OUT_NOPS), 255)
+            for written in (value, restored):
+                now = crtc.get_nops()
+                crtc.run_until_next_line()
+                step = PlanStep(crtc.get_nops() - now, register, written)
+                crtc.fast_forward(OUT_NOPS)
+                crtc.set_register(register, written)
+                plan.append(step)
+            delta -= value - restored
+
+        crtc.run_until_next_vsync()
+        if crtc.get_nops() != self._target_nops:
+            return None
+        return plan
+
+
+def plan_to_source(plan):
+    """Generate the z80 source code of a plan.
+
+    Parameters
+    ----------
+        - plan: list
+            PlanStep to generate
+
+    Returns
+    -------
+        String of z80 source code
+    """
+    code = ''
+    for step in plan:
+        if step.wait:
+            code += '    defs %d\n' % step.wait
+        code += '    ld bc, 0xbc00 + %d\n' % step.register
+        code += '    out (c), c\n'
+        code += '    ld bc, 0xbd00 + %d\n' % step.value
+        code += '    out (c), c\n'
+    return code
+
+
+if __name__ == '__main__':
+    planner = TransitionPlanner()
+    start = [63, 40, 46, 0x8e, 38, 0, 25, 30, 0, 7, 0, 0, 0x30, 0x00]
+
+    # Char lines of 4 lines with the same frame length, screen address
+    # change, and a shorter screen kept in a 19968 nops transition frame
+    examples = [
+        (start[:4] + [77, 0, 50, 60, 0, 3] + start[10:], None),
+        (start[:12] + [0x20, 0x80], None),
+        (start[:4] + [30] + start[5:], 19968),
+        ]
+    for stop, target_nops in examples:
+        plan = planner.plan(start, stop, target_nops)
+        if plan is None:
+            sys.stdout.write('No plan to %s\n' % stop)
+            continue
+        sys.stdout.write('; %s -> %s\n' % (start, stop))
+        sys.stdout.write(plan_to_source(plan))
+        sys.stdout.write('; transition frame, next frame: %d, %d\n\n'
+                         % planner.check(start, plan)[:2])
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
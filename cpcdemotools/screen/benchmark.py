@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Manually check and benchmark the pixels encoding
+
+The checks compare every implementation with the per-pixel encoders, for all
+the bytes and all the tuples of pens. The benchmarks print the throughput in
+encoded bytes per second.
+"""
+
+# imports
+import itertools
+import time
+
+import numpy as np
+
+import pixels_encoding
+from bulk_encoding import encode_pens, decode_bytes, get_masks, \
+        BYTE_ARRAYS, PEN_ARRAYS, PIXELS_PER_BYTE, NB_PENS
+from sprites import extract_sprites, get_grid_rectangles
+
+# code
+
+# Size in bytes of a standard screen
+SCREEN_HEIGHT = 200
+SCREEN_WIDTH = 80
+
+
+def _get_pixel_encoders(mode):
+    """Return the per-pixel encoders of a mode, from left to right."""
+    return [getattr(pixels_encoding, 'get_mode%d_pixel%d_byte_encoded'
+                    % (mode, pixel))
+            for pixel in range(PIXELS_PER_BYTE[mode])]
+
+
+def check_encoders():
+    """Check all the encoders and decoders against the per-pixel encoders."""
+    for mode in (0, 1, 2):
+        encoders = _get_pixel_encoders(mode)
+        get_byte = getattr(pixels_encoding, 'get_mode%d_byte' % mode)
+        get_pens = getattr(pixels_encoding, 'get_mode%d_pens' % mode)
+        get_mask = getattr(pixels_encoding, 'get_mode%d_mask' % mode)
+
+        all_pens = list(itertools.product(range(NB_PENS[mode]),
+                                          repeat=PIXELS_PER_BYTE[mode]))
+        expected = [reduce(lambda a, b: a | b,
+                           [encoder(pen) for encoder, pen in
+                            zip(encoders, pens)])
+                    for pens in all_pens]
+        assert sorted(expected) == range(256)
+
+        # One tuple of pens per line, encoded in bulk
+        bulk = encode_pens(np.array(all_pens), mode).ravel().tolist()
+        assert bulk == expected
+        assert BYTE_ARRAYS[mode].tolist() == expected
+        for pens, byte in zip(all_pens, expected):
+            assert get_byte(*pens) == byte
+            assert get_pens(byte) == pens
+
+        data = bytearray(range(256))
+        decoded = decode_bytes(data, mode).reshape(256, -1)
+        assert [tuple(pens) for pens in decoded] == \
+                [get_pens(byte) for byte in data]
+        assert (PEN_ARRAYS[mode] == decoded).all()
+
+        masks = get_masks(data, mode).tolist()
+        for byte, pens in zip(data, decoded):
+            transparent = [NB_PENS[mode] - 1 if pen == 0 else 0
+                           for pen in pens]
+            assert masks[byte] == get_mask(byte) == get_byte(*transparent)
+        print 'Mode %d: %d bytes checked' % (mode, len(expected))
+
+
+def _time(function, nb_repeats):
+    """Return the average duration of a call to function."""
+    begin = time.time()
+    for i in range(nb_repeats):
+        function()
+    return (time.time() - begin) / nb_repeats
+
+
+def bench_encoding(nb_repeats=20):
+    """Print the throughput of the encoding of full screens and sprite
+    sheets.
+
+    Parameters
+    ----------
+        - nb_repeats: int
+            Number of times each operation is timed
+    """
+    random = np.random.RandomState(0)
+    for mode in (0, 1, 2):
+        nb_pixels = PIXELS_PER_BYTE[mode]
+        pens = random.randint(0, NB_PENS[mode],
+                              (SCREEN_HEIGHT, SCREEN_WIDTH * nb_pixels))
+        pens = pens.astype(np.uint8)
+        data = encode_pens(pens, mode).tostring()
+        get_byte = getattr(pixels_encoding, 'get_mode%d_byte' % mode)
+        pixels = [tuple(int(pen) for pen in pens_)
+                  for pens_ in pens.reshape(-1, nb_pixels)]
+
+        # 8x16 sprites of 8 bytes and 16 lines, the upper half duplicated
+        sprites = random.randint(0, NB_PENS[mode],
+                                 (16 * 16, 8 * 8 * nb_pixels))
+        sprites[:128] = sprites[128:]
+        rectangles = get_grid_rectangles(8, 16, 8 * nb_pixels, 16)
+
+        for name, function, nb_bytes in (
+                ('get_mode%d_byte' % mode,
+                 lambda: [get_byte(*_) for _ in pixels], len(data)),
+                ('encode_pens', lambda: encode_pens(pens, mode), len(data)),
+                ('decode_bytes', lambda: decode_bytes(data, mode), len(data)),
+                ('extract_sprites',
+                 lambda: extract_sprites(sprites, rectangles, mode),
+                 sprites.size // nb_pixels)):
+            duration = _time(function, nb_repeats)
+            print 'Mode %d %-16s %14d bytes/s' % (mode, name,
+                                                  nb_bytes / duration)
+
+
+if __name__ == '__main__':
+    check_encoders()
+    bench_encoding()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
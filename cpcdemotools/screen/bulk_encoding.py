@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Bulk pixels encoding.
+
+Encode whole images of pens to CPC bytes, decode CPC bytes to pens, convert
+them between modes and build their masks, with NumPy, using the tables of
+pixels_encoding.
+"""
+
+# imports
+import numpy as np
+
+from pixels_encoding import MODE0_BYTES, MODE1_BYTES, MODE2_BYTES, \
+        MODE0_PENS, MODE1_PENS, MODE2_PENS, \
+        MODE0_MASKS, MODE1_MASKS, MODE2_MASKS
+
+# code
+
+# Number of pixels in a byte for each mode
+PIXELS_PER_BYTE = {0: 2, 1: 4, 2: 8}
+
+# Number of pens for each mode
+NB_PENS = {0: 16, 1: 4, 2: 2}
+
+
+def _build_byte_array(encoding_table, mode):
+    """Return the array of the byte of each packed tuple of pens.
+    The pens of the tuple are packed from the high bits (left pixel) to the
+    low bits (right pixel)."""
+    bits = 8 // PIXELS_PER_BYTE[mode]
+    array = np.zeros(256, dtype=np.uint8)
+    for pens, byte in encoding_table.items():
+        array[reduce(lambda index, pen: (index << bits) | pen, pens)] = byte
+    return array
+
+
+# Byte of each packed tuple of pens
+BYTE_ARRAYS = {
+    0: _build_byte_array(MODE0_BYTES, 0),
+    1: _build_byte_array(MODE1_BYTES, 1),
+    2: _build_byte_array(MODE2_BYTES, 2),
+}
+
+
+# Pens of each byte (one line per byte)
+PEN_ARRAYS = {
+    0: np.array(MODE0_PENS, dtype=np.uint8),
+    1: np.array(MODE1_PENS, dtype=np.uint8),
+    2: np.array(MODE2_PENS, dtype=np.uint8),
+}
+
+# AND mask of each byte
+MASK_ARRAYS = {
+    0: np.array(MODE0_MASKS, dtype=np.uint8),
+    1: np.array(MODE1_MASKS, dtype=np.uint8),
+    2: np.array(MODE2_MASKS, dtype=np.uint8),
+}
+
+
+def _as_byte_array(data):
+    """Return bytes as a uint8 array, without copy."""
+    if isinstance(data, np.ndarray):
+        return data.astype(np.uint8, copy=False)
+    if isinstance(data, memoryview):
+        # frombuffer does not take memoryviews in Python 2
+        return np.asarray(data).view(np.uint8)
+    return np.frombuffer(data, dtype=np.uint8)
+
+
+def encode_pens(pens, mode):
+    """Encode an image of pens to CPC bytes.
+
+    Parameters
+    ----------
+        - pens: array
+            2D array of pens (one line per row of pixels). The width must be
+            a multiple of the number of pixels in a byte
+        - mode: int
+            Screen mode (0, 1 or 2)
+
+    Returns
+    -------
+        2D uint8 array of bytes (one line per row of pixels)
+    """
+    pens = np.asarray(pens)
+    if pens.ndim != 2:
+        raise ValueError('pens must be a 2D array')
+    nb_pixels = PIXELS_PER_BYTE[mode]
+    height, width = pens.shape
+    if width % nb_pixels:
+        raise ValueError('Width %d is not a multiple of %d pixels'
+                         % (width, nb_pixels))
+    if pens.size and (pens.min() < 0 or pens.max() >= NB_PENS[mode]):
+        raise ValueError('Pens out of range for mode %d' % mode)
+
+    # Pack the pens of each byte, then translate with the table
+    pixels = pens.astype(np.uint8).reshape(height, width // nb_pixels,
+                                           nb_pixels)
+    bits = 8 // nb_pixels
+    shifts = np.arange(nb_pixels - 1, -1, -1, dtype=np.uint8) * bits
+    indices = np.bitwise_or.reduce(pixels << shifts, axis=2)
+    return BYTE_ARRAYS[mode][indices]
+
+
+def decode_bytes(data, mode):
+    """Decode CPC bytes to pens.
+
+    Parameters
+    ----------
+        - data: str, bytearray, memoryview or array
+            Bytes to decode. Buffers are read without copy; arrays keep their
+            shape, their last dimension being multiplied by the number of
+            pixels in a byte
+        - mode: int
+            Screen mode (0, 1 or 2)
+
+    Returns
+    -------
+        uint8 array of pens
+    """
+    data = _as_byte_array(data)
+    pens = PEN_ARRAYS[mode][data]
+    return pens.reshape(data.shape[:-1] + (-1,))
+
+
+def get_masks(data, mode):
+    """Return the AND masks of CPC bytes (pen 0 is transparent).
+    A masked sprite is drawn with screen & mask | data.
+
+    Parameters
+    ----------
+        - data: str, bytearray, memoryview or array
+            Bytes of the sprite (see decode_bytes)
+        - mode: int
+            Screen mode (0, 1 or 2)
+
+    Returns
+    -------
+        uint8 array of the masks, of the shape of data
+    """
+    data = _as_byte_array(data)
+    return MASK_ARRAYS[mode][data]
+
+
+def convert_mode(data, source_mode, destination_mode, pen_map=None):
+    """Convert CPC bytes from a mode to another one.
+    The bytes keep the same size on screen: pixels are repeated to a higher
+    resolution, and only the left pixels are kept to a lower one.
+
+    Parameters
+    ----------
+        - data: str, bytearray, memoryview or array
+            Bytes to convert (see decode_bytes)
+        - source_mode, destination_mode: int
+            Screen modes (0, 1 or 2)
+        - pen_map: list
+            Pen of the destination mode of each pen of the source mode
+            (pens are kept if None)
+
+    Returns
+    -------
+        uint8 array of bytes, of the shape of data
+    """
+    pens = decode_bytes(data, source_mode)
+    shape = pens.shape[:-1] + (-1,)
+    pens = pens.reshape(-1, pens.shape[-1])
+
+    source_pixels = PIXELS_PER_BYTE[source_mode]
+    destination_pixels = PIXELS_PER_BYTE[destination_mode]
+    if destination_pixels > source_pixels:
+        pens = pens.repeat(destination_pixels // source_pixels, axis=1)
+    else:
+        pens = pens[:, ::source_pixels // destination_pixels]
+
+    if pen_map is not None:
+        pens = np.asarray(pen_map, dtype=np.uint8)[pens]
+    return encode_pens(pens, destination_mode).reshape(shape)
+
+
+def test_encode_pens():
+    """Compare the bulk encoding with the byte functions"""
+    from pixels_encoding import get_mode0_byte, get_mode1_byte, \
+            get_mode2_byte
+
+    functions = {0: get_mode0_byte, 1: get_mode1_byte, 2: get_mode2_byte}
+    random = np.random.RandomState(0)
+    for mode in (0, 1, 2):
+        nb_pixels = PIXELS_PER_BYTE[mode]
+        pens = random.randint(0, NB_PENS[mode], (10, 8 * nb_pixels))
+        encoded = encode_pens(pens, mode)
+        for row in range(pens.shape[0]):
+            for column in range(encoded.shape[1]):
+                pixels = pens[row, column * nb_pixels:(column + 1) * nb_pixels]
+                assert encoded[row, column] == functions[mode](*pixels)
+
+
+def test_decode_bytes():
+    """Compare the bulk decoding with the pens functions"""
+    from pixels_encoding import get_mode0_pens, get_mode1_pens, \
+            get_mode2_pens
+
+    functions = {0: get_mode0_pens, 1: get_mode1_pens, 2: get_mode2_pens}
+    data = bytearray(range(256))
+    for mode in (0, 1, 2):
+        pens = decode_bytes(data, mode)
+        assert list(pens) == sum([list(functions[mode](byte))
+                                  for byte in data], [])
+        encoded = encode_pens(pens.reshape(16, -1), mode)
+        assert (decode_bytes(encoded, mode) == pens.reshape(16, -1)).all()
+        assert (decode_bytes(memoryview(data)[16:], mode) ==
+                pens[16 * PIXELS_PER_BYTE[mode]:]).all()
+
+
+
+def test_convert_mode():
+    """Convert and mask bytes"""
+    from pixels_encoding import get_mode0_mask, get_mode0_byte, \
+            get_mode1_byte
+
+    data = bytearray(range(256))
+    assert get_masks(data, 0).tolist() == [get_mode0_mask(byte)
+                                           for byte in data]
+    mode1 = convert_mode(data, 0, 1, pen_map=[pen & 3 for pen in range(16)])
+    for byte, converted in zip(data, mode1):
+        pen0, pen1 = decode_bytes(bytearray([byte]), 0)
+        assert converted == get_mode1_byte(pen0 & 3, pen0 & 3,
+                                           pen1 & 3, pen1 & 3)
+    assert (convert_mode(mode1, 1, 0) == [get_mode0_byte(pens[0], pens[2])
+            for pens in decode_bytes(mode1, 1).reshape(-1, 4)]).all()
+    assert (convert_mode(data, 2, 2) == data).all()
+
+
+if __name__ == '__main__':
+    test_encode_pens()
+    test_decode_bytes()
+    test_convert_mode()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Frame delta encoding.
+
+Compute the bytes which change between the successive screens of an
+animation, and the cost (in nops) of the z80 code which applies them, either
+with LD instructions (code only) or with LDI instructions (code and data).
+"""
+
+# imports
+import collections
+import struct
+
+import numpy as np
+
+# code
+
+# Duration in nops of the instructions of the generated code
+NOPS = {
+    'ld a, n': 2,
+    'ld hl, nn': 3,
+    'ld de, nn': 3,
+    'ld l, n': 2,
+    'inc l': 1,
+    'inc hl': 2,
+    'ld (hl), n': 3,
+    'ld (hl), a': 2,
+    'ldi': 5,
+}
+
+DeltaFrame = collections.namedtuple('DeltaFrame', [
+    'addresses',        # Addresses of the changed bytes
+    'values',           # New values of the changed bytes
+    'runs',             # (address, bytes) of each run of changed bytes
+    'ld_nops',          # Duration of the LD code
+    'ldi_nops',         # Duration of the LDI code
+    ])
+
+
+def _as_array(screen):
+    """Return a screen as a uint8 array (without copy)."""
+    if isinstance(screen, np.ndarray):
+        return screen.astype(np.uint8, copy=False).ravel()
+    return np.frombuffer(screen, dtype=np.uint8)
+
+
+def _get_ld_nops(addresses, values):
+    """Return the duration of the LD code of the changed bytes.
+    HL goes from a changed byte to the next one with the cheapest
+    instruction, and A holds the most frequent value."""
+    if not len(addresses):
+        return 0
+
+    previous = addresses[:-1]
+    following = addresses[1:]
+    same_page = (previous >> 8) == (following >> 8)
+    next_byte = following - previous == 1
+    moves = np.where(same_page,
+                     np.where(next_byte, NOPS['inc l'], NOPS['ld l, n']),
+                     np.where(next_byte, NOPS['inc hl'], NOPS['ld hl, nn']))
+
+    nb_a = np.bincount(values, minlength=256).max()
+    writes = nb_a * NOPS['ld (hl), a'] + \
+            (len(values) - nb_a) * NOPS['ld (hl), n']
+
+    return NOPS['ld a, n'] + NOPS['ld hl, nn'] + int(moves.sum()) + writes
+
+
+def _get_runs(changed):
+    """Return the start and stop indices of the runs of True."""
+    edges = np.diff(np.concatenate(([0], changed.astype(np.int8), [0])))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def compute_deltas(screens, base=0xC000, initial=None):
+    """Compute the deltas between successive screens.
+
+    Parameters
+    ----------
+        - screens: list
+            Encoded screens (str, bytearray or arrays of the same size)
+        - base: int
+            Address of the first byte of the screens
+        - initial: str or array
+            Screen displayed before the first one (if None, the first screen
+            is the reference and has no delta)
+
+    Returns
+    -------
+        List of DeltaFrame
+    """
+    screens = [_as_array(screen) for screen in screens]
+    if initial is None:
+        previous, screens = screens[0], screens[1:]
+    else:
+        previous = _as_array(initial)
+
+    deltas = []
+    for screen in screens:
+        if screen.shape != previous.shape:
+            raise ValueError('Screens must have the same size')
+        changed = screen != previous
+        indices = np.flatnonzero(changed)
+        addresses = indices + base
+        values = screen[indices]
+
+        starts, stops = _get_runs(changed)
+        runs = [(base + start, screen[start:stop].tostring())
+                for start, stop in zip(starts, stops)]
+        ldi_nops = NOPS['ld hl, nn'] + len(runs) * NOPS['ld de, nn'] + \
+                len(indices) * NOPS['ldi'] if runs else 0
+
+        deltas.append(DeltaFrame(addresses=addresses,
+                                 values=values,
+                                 runs=runs,
+                                 ld_nops=_get_ld_nops(addresses, values),
+                                 ldi_nops=ldi_nops))
+        previous = screen
+    return deltas
+
+
+def get_frames_over_budget(deltas, budget):
+    """Return the indices of the deltas whose cheapest code (LD or LDI) lasts
+    more than budget nops."""
+    return [index for index, delta in enumerate(deltas)
+            if min(delta.ld_nops, delta.ldi_nops) > budget]
+
+
+def pack_delta_stream(deltas):
+    """Return the binary stream of the runs of the deltas.
+    Each frame is its number of runs (word), then each run is its address
+    (word), its length (word) and its bytes. Words are little endian.
+
+    Parameters
+    ----------
+        - deltas: list
+            DeltaFrame to pack
+    """
+    stream = []
+    for delta in deltas:
+        stream.append(struct.pack('<H', len(delta.runs)))
+        for address, data in delta.runs:
+            stream.append(struct.pack('<HH', address, len(data)))
+            stream.append(data)
+    return ''.join(stream)
+
+
+def generate_ld_source(delta):
+    """Generate the LD z80 code of a delta (see DeltaFrame.ld_nops)."""
+    if not len(delta.addresses):
+        return ''
+
+    A = np.bincount(delta.values, minlength=256).argmax()
+    code = '    ld a, %d\n' % A
+    HL = None
+    for address, value in zip(delta.addresses, delta.values):
+        if HL is None or (HL >> 8 != address >> 8 and address - HL != 1):
+            code += '    ld hl, 0x%04x\n' % address
+        elif address - HL == 1:
+            code += '    inc l\n' if HL >> 8 == address >> 8 \
+                    else '    inc hl\n'
+        else:
+            code += '    ld l, 0x%02x\n' % (address & 0xFF)
+        HL = address
+
+        if value == A:
+            code += '    ld (hl), a\n'
+        else:
+            code += '    ld (hl), %d\n' % value
+    return code
+
+
+def generate_ldi_source(delta, label):
+    """Generate the LDI z80 code of a delta (see DeltaFrame.ldi_nops).
+
+    Parameters
+    ----------
+        - delta: DeltaFrame
+            Delta to generate
+        - label: str
+            Label of the data of the runs
+
+    Returns
+    -------
+        (code, data) z80 sources
+    """
+    if not delta.runs:
+        return '', ''
+
+    code = '    ld hl, %s\n' % label
+    data = '%s\n' % label
+    for address, bytes_ in delta.runs:
+        code += '    ld de, 0x%04x\n' % address
+        code += '    ldi\n' * len(bytes_)
+        data += '    defb %s\n' % ', '.join(str(ord(byte)) for byte in bytes_)
+    return code, data
+
+
+def _normalize(line):
+    """Return the instruction of a generated line with generic operands."""
+    instruction = line.strip()
+    for register, generic in (('ld a, ', 'ld a, n'),
+                              ('ld hl, ', 'ld hl, nn'),
+                              ('ld de, ', 'ld de, nn'),
+                              ('ld l, ', 'ld l, n')):
+        if instruction.startswith(register):
+            return generic
+    if instruction.startswith('ld (hl), ') and instruction != 'ld (hl), a':
+        return 'ld (hl), n'
+    return instruction
+
+
+def test_compute_deltas():
+    """Compare the estimated nops with the generated code"""
+    random = np.random.RandomState(0)
+    screens = [random.randint(0, 4, 0x4000).astype(np.uint8)]
+    for frame in range(3):
+        screen = screens[-1].copy()
+        indices = random.randint(0, 0x4000, 300)
+        screen[indices] = random.randint(0, 256, 300)
+        screens.append(screen)
+
+    deltas = compute_deltas(screens)
+    assert len(deltas) == 3
+    assert get_frames_over_budget(deltas, 19968) == []
+    assert get_frames_over_budget(deltas, 10) == [0, 1, 2]
+    for previous, screen, delta in zip(screens, screens[1:], deltas):
+        rebuilt = previous.copy()
+        for address, data in delta.runs:
+            start = address - 0xC000
+            rebuilt[start:start + len(data)] = np.fromstring(data, np.uint8)
+        assert (rebuilt == screen).all()
+
+        code = generate_ld_source(delta)
+        assert sum(NOPS[_normalize(line)] for line in code.splitlines()) \
+                == delta.ld_nops
+        code, data = generate_ldi_source(delta, 'delta')
+        assert sum(NOPS[_normalize(line)] for line in code.splitlines()) \
+                == delta.ldi_nops
+
+    assert len(pack_delta_stream(deltas)) == sum(
+            2 + sum(4 + len(data) for address, data in delta.runs)
+            for delta in deltas)
+
+
+if __name__ == '__main__':
+    test_compute_deltas()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
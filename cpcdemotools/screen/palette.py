@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Palette quantization.
+
+Convert RGB images to the pens of a screen mode: choose the firmware colours
+of the pens among the 27 colours of the CPC, then map each pixel to its
+nearest pen (optionally with ordered dithering) through lookup tables of the
+RGB cube.
+"""
+
+# imports
+import numpy as np
+
+# code
+
+# Number of pens for each mode
+NB_PENS = {0: 16, 1: 4, 2: 2}
+
+# Intensity of the 3 levels of each RGB component
+LEVELS = (0x00, 0x80, 0xFF)
+
+# RGB of the firmware colours (colour n is 9 * green + 3 * red + blue levels)
+FIRMWARE_COLOURS = np.array([(LEVELS[(n // 3) % 3], LEVELS[n // 9],
+                              LEVELS[n % 3]) for n in range(27)])
+
+# Gate array value of the firmware colours
+HARDWARE_COLOURS = [0x54, 0x44, 0x55, 0x5C, 0x58, 0x5D, 0x4C, 0x45, 0x4D,
+                    0x56, 0x46, 0x57, 0x5E, 0x40, 0x5F, 0x4E, 0x47, 0x4F,
+                    0x52, 0x42, 0x53, 0x5A, 0x59, 0x5B, 0x4A, 0x43, 0x4B]
+
+# Bits of each RGB component kept in the lookup tables
+LUT_BITS = 5
+
+# 4x4 ordered dithering matrix (values in [-0.5, 0.5[)
+BAYER_MATRIX = (np.array([[0, 8, 2, 10],
+                          [12, 4, 14, 6],
+                          [3, 11, 1, 9],
+                          [15, 7, 13, 5]]) + 0.5) / 16 - 0.5
+
+# Already computed lookup tables
+_lookup_tables = {}
+
+
+def _get_distances(colours, palette):
+    """Return the squared distances between RGB colours and the firmware
+    colours of a palette (one column per colour of the palette)."""
+    differences = colours[..., np.newaxis, :] - \
+            FIRMWARE_COLOURS[list(palette)]
+    return (differences ** 2).sum(axis=-1)
+
+
+def get_lookup_table(palette):
+    """Return the index in palette of the nearest colour of each RGB colour.
+    Tables are computed once for each palette, and are read only.
+
+    Parameters
+    ----------
+        - palette: tuple
+            Firmware colours
+
+    Returns
+    -------
+        uint8 array indexed by the LUT_BITS high bits of red, green and blue
+    """
+    palette = tuple(palette)
+    if palette not in _lookup_tables:
+        size = 1 << LUT_BITS
+        step = 256 // size
+        levels = np.arange(size) * step + step // 2
+        cube = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'),
+                        axis=-1)
+        table = _get_distances(cube, palette).argmin(axis=-1)
+        table = table.astype(np.uint8)
+        table.flags.writeable = False
+        _lookup_tables[palette] = table
+    return _lookup_tables[palette]
+
+
+def _lookup(rgb, palette):
+    """Map an RGB image to the indices of its nearest colours in palette."""
+    indices = np.clip(rgb, 0, 255).astype(np.uint8) >> (8 - LUT_BITS)
+    return get_lookup_table(palette)[indices[..., 0], indices[..., 1],
+                                     indices[..., 2]]
+
+
+def choose_palette(rgb, nb_pens, nb_iterations=10):
+    """Choose the firmware colours of the pens for an image.
+    Pixels are mapped to their nearest firmware colour, then the most used
+    colours are refined as the weighted medoids of the colours they
+    represent.
+
+    Parameters
+    ----------
+        - rgb: array
+            Image of RGB pixels (last dimension of size 3)
+        - nb_pens: int
+            Number of pens
+        - nb_iterations: int
+            Maximum number of refinements
+
+    Returns
+    -------
+        List of at most nb_pens firmware colours, the most used first
+    """
+    counts = np.bincount(_lookup(rgb, range(27)).ravel(), minlength=27)
+    used = np.flatnonzero(counts)
+    palette = sorted(used, key=lambda colour: -counts[colour])[:nb_pens]
+    if len(used) <= nb_pens:
+        return [int(colour) for colour in palette]
+
+    # Cost of representing each colour (row) by each colour (column)
+    costs = _get_distances(FIRMWARE_COLOURS, range(27)) * \
+            counts[:, np.newaxis]
+    for iteration in range(nb_iterations):
+        nearest = _get_distances(FIRMWARE_COLOURS, palette).argmin(axis=1)
+        refined = []
+        for pen in range(len(palette)):
+            members = (nearest == pen) & (counts > 0)
+            if not members.any():
+                refined.append(palette[pen])
+                continue
+            # Colours of the other pens are not candidates
+            medoid_costs = costs[members].sum(axis=0).astype(float)
+            medoid_costs[refined + palette[pen + 1:]] = np.inf
+            refined.append(medoid_costs.argmin())
+        if refined == palette:
+            break
+        palette = refined
+
+    weights = np.bincount(
+            _get_distances(FIRMWARE_COLOURS, palette).argmin(axis=1),
+            weights=counts, minlength=len(palette))
+    order = np.argsort(-weights, kind='mergesort')
+    return [int(palette[pen]) for pen in order]
+
+
+def quantize(rgb, mode, palette=None, dither=False):
+    """Convert an RGB image to pens.
+
+    Parameters
+    ----------
+        - rgb: array
+            Image of RGB pixels (height, width, 3) at the resolution of the
+            mode (e.g. 160 pixels per line in mode 0)
+        - mode: int
+            Screen mode (0, 1 or 2)
+        - palette: list
+            Firmware colours of the pens (chosen with choose_palette if None)
+        - dither: bool
+            if True, use ordered dithering
+
+    Returns
+    -------
+        (2D uint8 array of pens, palette)
+    """
+    rgb = np.asarray(rgb)
+    if palette is None:
+        palette = choose_palette(rgb, NB_PENS[mode])
+    if len(palette) > NB_PENS[mode]:
+        raise ValueError('Too many colours for mode %d' % mode)
+
+    if dither:
+        height, width = rgb.shape[:2]
+        threshold = np.tile(BAYER_MATRIX, (height // 4 + 1, width // 4 + 1))
+        rgb = rgb + threshold[:height, :width, np.newaxis] * \
+                (LEVELS[1] - LEVELS[0])
+    return _lookup(rgb, palette), palette
+
+
+def get_hardware_colours(palette):
+    """Return the gate array values of the colours of a palette."""
+    return [HARDWARE_COLOURS[colour] for colour in palette]
+
+
+def read_rgb_image(fname):
+    """Read an image file (PNG...) as an RGB array.
+    Needs PIL.
+    """
+    from PIL import Image
+    return np.asarray(Image.open(fname).convert('RGB'))
+
+
+def test_quantize():
+    """Convert images made of firmware colours"""
+    assert FIRMWARE_COLOURS[6].tolist() == [0xFF, 0x00, 0x00]
+    assert FIRMWARE_COLOURS[18].tolist() == [0x00, 0xFF, 0x00]
+    assert FIRMWARE_COLOURS[26].tolist() == [0xFF, 0xFF, 0xFF]
+
+    random = np.random.RandomState(0)
+    colours = random.randint(0, 27, (50, 80))
+    colours[colours == 13] = 0
+    rgb = FIRMWARE_COLOURS[colours]
+    pens, palette = quantize(rgb, 0)
+    assert len(palette) == 16
+    assert pens.max() < 16
+
+    # Pens have distinct colours
+    for seed in range(200):
+        rgb = np.random.RandomState(seed).randint(0, 256, (20, 20, 3))
+        for nb_pens in (2, 4, 16):
+            palette = choose_palette(rgb, nb_pens)
+            assert len(set(palette)) == len(palette)
+
+    # Grey (13) is a colour of the image with only 2 pens
+    rgb = FIRMWARE_COLOURS[np.array([[0, 13, 26, 13]] * 4)]
+    pens, palette = quantize(rgb, 2)
+    assert palette[0] == 13
+
+    pens, palette = quantize(rgb, 1)
+    assert sorted(palette) == [0, 13, 26]
+    assert (np.array(palette)[pens] == [[0, 13, 26, 13]] * 4).all()
+
+    pens, palette = quantize(np.full((8, 8, 3), 0x40), 2, palette=[0, 13],
+                             dither=True)
+    assert 0 < pens.sum() < 64
+
+
+if __name__ == '__main__':
+    test_quantize()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
@@ -141,61 +141,138 @@ def get_mode2_pixel7_byte_encoded(pen):
 
 
 
-def get_mode0_byte(pen0, pen1):
-    """untested"""
-    return get_mode0_pixel0_byte_encoded(pen0) |  get_mode0_pixel1_byte_encoded(pen1)
+def _build_encoding_table(pixel_encoders, nb_pens):
+    """Return the dict of the byte of each tuple of pens"""
+    table = {}
+    nb_pixels = len(pixel_encoders)
+    for index in range(256):
+        # Enumerate the tuples of pens from the bits of index
+        pens = []
+        for pixel in range(nb_pixels):
+            shift = (nb_pixels - 1 - pixel) * (8 // nb_pixels)
+            pens.append((index >> shift) & (nb_pens - 1))
+
+        table[tuple(pens)] = reduce(lambda a, b: a | b,
+                [encoder(pen) for encoder, pen in zip(pixel_encoders, pens)])
+    return table
+
+def _build_decoding_table(encoding_table):
+    """Return the list of the tuple of pens of each byte"""
+    table = [None] * 256
+    for pens, byte in encoding_table.items():
+        table[byte] = pens
+    return table
+
+def _build_mask_table(encoding_table, nb_pens):
+    """Return the list of the AND mask of each byte: the bits of the pixels
+    of pen 0 (transparent) are set"""
+    table = [None] * 256
+    for pens, byte in encoding_table.items():
+        mask = 0
+        for pixel, pen in enumerate(pens):
+            if pen == 0:
+                full = [0] * len(pens)
+                full[pixel] = nb_pens - 1
+                mask = mask | encoding_table[tuple(full)]
+        table[byte] = mask
+    return table
+
+
+# Byte of each tuple of pens (from left to right pixel) in each mode
+MODE0_BYTES = _build_encoding_table([get_mode0_pixel0_byte_encoded,
+                                     get_mode0_pixel1_byte_encoded], 16)
+MODE1_BYTES = _build_encoding_table([get_mode1_pixel0_byte_encoded,
+                                     get_mode1_pixel1_byte_encoded,
+                                     get_mode1_pixel2_byte_encoded,
+                                     get_mode1_pixel3_byte_encoded], 4)
+MODE2_BYTES = _build_encoding_table([get_mode2_pixel0_byte_encoded,
+                                     get_mode2_pixel1_byte_encoded,
+                                     get_mode2_pixel2_byte_encoded,
+                                     get_mode2_pixel3_byte_encoded,
+                                     get_mode2_pixel4_byte_encoded,
+                                     get_mode2_pixel5_byte_encoded,
+                                     get_mode2_pixel6_byte_encoded,
+                                     get_mode2_pixel7_byte_encoded], 2)
+
+# Tuple of pens of each byte in each mode
+MODE0_PENS = _build_decoding_table(MODE0_BYTES)
+MODE1_PENS = _build_decoding_table(MODE1_BYTES)
+MODE2_PENS = _build_decoding_table(MODE2_BYTES)
+
+# AND mask of each byte in each mode (pen 0 is transparent)
+MODE0_MASKS = _build_mask_table(MODE0_BYTES, 16)
+MODE1_MASKS = _build_mask_table(MODE1_BYTES, 4)
+MODE2_MASKS = _build_mask_table(MODE2_BYTES, 2)
+
 
+def get_mode0_byte(pen0, pen1):
+    """Return the byte of two mode 0 pixels"""
+    return MODE0_BYTES[pen0, pen1]
 
 
 def get_mode1_byte(pen0, pen1, pen2, pen3):
-    return get_mode1_pixel0_byte_encoded(pen0) |  \
-            get_mode1_pixel1_byte_encoded(pen1) | \
-            get_mode1_pixel2_byte_encoded(pen2) | \
-            get_mode1_pixel3_byte_encoded(pen3)
+    """Return the byte of four mode 1 pixels"""
+    return MODE1_BYTES[pen0, pen1, pen2, pen3]
 
 
 def get_mode2_byte(pen0, pen1, pen2, pen3, pen4, pen5, pen6, pen7):
-    return get_mode2_pixel0_byte_encoded(pen0) |  \
-            get_mode2_pixel1_byte_encoded(pen1) | \
-            get_mode2_pixel2_byte_encoded(pen2) | \
-            get_mode2_pixel3_byte_encoded(pen3) | \
-            get_mode2_pixel4_byte_encoded(pen4) | \
-            get_mode2_pixel5_byte_encoded(pen5) | \
-            get_mode2_pixel6_byte_encoded(pen6) | \
-            get_mode2_pixel7_byte_encoded(pen7)
+    """Return the byte of eight mode 2 pixels"""
+    return MODE2_BYTES[pen0, pen1, pen2, pen3, pen4, pen5, pen6, pen7]
 
 
+def get_mode0_pens(byte):
+    """Return pens for byte"""
+    return MODE0_PENS[byte]
 
 
+def get_mode1_pens(byte):
+    """Return the four mode 1 pens of byte"""
+    return MODE1_PENS[byte]
+
+
+def get_mode2_pens(byte):
+    """Return the eight mode 2 pens of byte"""
+    return MODE2_PENS[byte]
+
+
+def get_mode0_mask(byte):
+    """Return the AND mask keeping the screen under the pixels of pen 0 of
+    byte (draw with screen & mask | byte)"""
+    return MODE0_MASKS[byte]
 
-def get_mode0_pens(byte):
-    """Return pends for byte"""
-    #XXX TODO test
 
-    assert byte < 256
-    pen0 = 0
-    pen1 = 0
+def get_mode1_mask(byte):
+    """Return the AND mask of a mode 1 byte (see get_mode0_mask)"""
+    return MODE1_MASKS[byte]
 
-    if byte & (2**7):
-        pen0 = pen0 + 1
-    if byte & (2**3):
-        pen0 = pen0 + 2
-    if byte & (2**5):
-        pen0 = pen0 + 4
-    if byte & (2**1):
-        pen0 = pen0 + 8
 
-    if byte & (2**6):
-        pen1 = pen1 + 1
-    if byte & (2**2):
-        pen1 = pen1 + 2
-    if byte & (2**4):
-        pen1 = pen1 + 4
-    if byte & (2**0):
-        pen1 = pen1 + 8
+def get_mode2_mask(byte):
+    """Return the AND mask of a mode 2 byte (see get_mode0_mask)"""
+    return MODE2_MASKS[byte]
 
-    return pen0, pen1
 
+def test_tables():
+    """Check the tables against the pixel encoders"""
+    for pens, byte in MODE0_BYTES.items():
+        assert byte == get_mode0_pixel0_byte_encoded(pens[0]) | \
+                get_mode0_pixel1_byte_encoded(pens[1])
+        assert get_mode0_pens(byte) == pens
+    for table, pens_table in ((MODE0_BYTES, MODE0_PENS),
+                              (MODE1_BYTES, MODE1_PENS),
+                              (MODE2_BYTES, MODE2_PENS)):
+        assert sorted(table.values()) == range(256)
+        assert [table[pens] for pens in pens_table] == range(256)
+    assert get_mode2_byte(1, 0, 0, 0, 0, 0, 0, 1) == 0x81
+    assert get_mode1_pens(get_mode1_byte(3, 2, 1, 0)) == (3, 2, 1, 0)
 
+    assert get_mode0_mask(0) == 0xFF
+    assert get_mode0_mask(get_mode0_byte(0, 5)) == get_mode0_byte(15, 0)
+    assert get_mode1_mask(get_mode1_byte(1, 0, 2, 0)) == \
+            get_mode1_byte(0, 3, 0, 3)
+    assert get_mode2_mask(0x81) == 0x7E
+    for masks in (MODE0_MASKS, MODE1_MASKS, MODE2_MASKS):
+        assert all(byte & mask == 0 for byte, mask in enumerate(masks))
 
 
+if __name__ == '__main__':
+    test_tables()
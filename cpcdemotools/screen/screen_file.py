@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Screen files.
+
+Read .SCR files and raw screen dumps (16KB or 32KB, with or without an AMSDOS
+header) through a memory map: only the lines and regions which are requested
+are read from the disk and decoded.
+"""
+
+# imports
+import collections
+import mmap
+import struct
+
+import numpy as np
+
+from bulk_encoding import decode_bytes
+from screen_layout import get_address_table, get_screen_address
+
+# code
+
+AMSDOS_HEADER_SIZE = 128
+
+# Size of a block of lines sharing the same RA
+BLOCK_SIZE = 0x800
+
+AmsdosHeader = collections.namedtuple('AmsdosHeader', [
+    'user',             # User number
+    'filename',         # Name and extension (11 chars)
+    'file_type',        # 0 basic, 1 protected, 2 binary
+    'load_address',     # Address where the file is loaded
+    'length',           # Length of the data
+    'entry_address',    # Execution address
+    ])
+
+
+def read_amsdos_header(data):
+    """Read the AMSDOS header at the beginning of data.
+
+    Parameters
+    ----------
+        - data: str or array
+            Whole file
+
+    Returns
+    -------
+        An AmsdosHeader, or None if data does not start with a valid header
+        (the checksum of the first 67 bytes does not match, the header is
+        blank or its length goes past the end of the file)
+    """
+    if len(data) < AMSDOS_HEADER_SIZE:
+        return None
+    header = bytearray(data[:AMSDOS_HEADER_SIZE])
+    checksum, = struct.unpack('<H', str(header[67:69]))
+    if sum(header[:67]) & 0xFFFF != checksum or not any(header[:67]):
+        return None
+
+    load_address, = struct.unpack('<H', str(header[21:23]))
+    entry_address, = struct.unpack('<H', str(header[26:28]))
+    length = header[64] | (header[65] << 8) | (header[66] << 16)
+    if AMSDOS_HEADER_SIZE + length > len(data):
+        return None
+    return AmsdosHeader(user=header[0],
+                        filename=str(header[1:12]),
+                        file_type=header[18],
+                        load_address=load_address,
+                        length=length,
+                        entry_address=entry_address)
+
+
+class ScreenFile(object):
+    """Memory mapped screen file.
+    The file is a dump of the memory displayed by the CRTC configuration,
+    starting at the beginning of the 16KB bank of the screen (or at the load
+    address of its AMSDOS header, when this address contains the screen).
+    """
+
+    def __init__(self, fname, mode=1, R1=40, R6=25, R9=7, R12=0x30,
+                 R13=0x00):
+        """Map the file.
+
+        Parameters
+        ----------
+            - fname: str
+                Name of the file
+            - mode: int
+                Screen mode (0, 1 or 2)
+            - R1, R6, R9, R12, R13: int
+                Values of the CRTC registers which displayed the screen
+                (a standard 16KB screen at 0xC000 by default)
+        """
+        self.mode = mode
+        self._file = open(fname, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._table = get_address_table(R1, R6, R9, R12, R13)
+        self.header = read_amsdos_header(self._mmap)
+        if self.header is not None and \
+                self._contains(self.header.load_address,
+                               len(self._mmap) - AMSDOS_HEADER_SIZE):
+            offset = AMSDOS_HEADER_SIZE
+            self.base = self.header.load_address
+        else:
+            # Raw dump (or header of another kind of file)
+            self.header = None
+            offset = 0
+            self.base = get_screen_address(R12, R13) & 0xC000
+            if not self._contains(self.base, len(self._mmap)):
+                self.close()
+                raise ValueError('%s does not contain the screen' % fname)
+
+        # View of the mapped file (no data is read)
+        self._data = np.frombuffer(self._mmap, dtype=np.uint8, offset=offset)
+
+    def _contains(self, base, size):
+        """Return True if size bytes loaded at base contain the screen."""
+        return int(self._table.min()) >= base and \
+                int(self._table.max()) - base < size
+
+    def close(self):
+        """Unmap and close the file.
+        The views returned by the other methods must not be used anymore."""
+        self._data = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_nb_lines(self):
+        """Return the number of lines of the screen."""
+        return self._table.shape[0]
+
+    def get_line(self, line):
+        """Return the bytes of a line of the screen.
+
+        Returns
+        -------
+            memoryview on the file if the line is contiguous in memory (always
+            the case for a screen of a single bank), on a copy otherwise
+        """
+        addresses = self._table[line]
+        start = int(addresses[0]) - self.base
+        if int(addresses[-1]) - self.base == start + len(addresses) - 1:
+            return memoryview(self._data[start:start + len(addresses)])
+        return memoryview(self._data[addresses - self.base])
+
+    def get_block(self, address):
+        """Return the 2KB block of memory starting at address (the lines of
+        a same RA).
+
+        Returns
+        -------
+            memoryview on the file
+        """
+        start = address - self.base
+        if start < 0 or start + BLOCK_SIZE > len(self._data):
+            raise ValueError('Block 0x%04x is not in the file' % address)
+        return memoryview(self._data[start:start + BLOCK_SIZE])
+
+    def get_bytes(self, line, column, nb_lines, nb_columns):
+        """Return the bytes of a region of the screen.
+
+        Parameters
+        ----------
+            - line, column: int
+                Position of the region (in lines and bytes)
+            - nb_lines, nb_columns: int
+                Size of the region (in lines and bytes)
+
+        Returns
+        -------
+            uint8 array of nb_lines lines of nb_columns bytes
+        """
+        addresses = self._table[line:line + nb_lines,
+                                column:column + nb_columns]
+        return self._data[addresses - self.base]
+
+    def get_pens(self, line, column, nb_lines, nb_columns):
+        """Decode the pens of a region of the screen (see get_bytes).
+
+        Returns
+        -------
+            uint8 array of nb_lines lines of pens
+        """
+        return decode_bytes(self.get_bytes(line, column, nb_lines, nb_columns),
+                            self.mode)
+
+
+def test_screen_file():
+    """Read a screen with and without AMSDOS header"""
+    import os
+    import tempfile
+
+    random = np.random.RandomState(0)
+    dump = random.randint(0, 256, 0x4000).astype(np.uint8)
+    table = get_address_table(40, 25, 7, 0x30, 0x00)
+
+    header = bytearray(AMSDOS_HEADER_SIZE)
+    header[1:12] = 'SCREEN  SCR'
+    header[18] = 2
+    header[21:23] = struct.pack('<H', 0xC000)
+    header[64:67] = struct.pack('<I', 0x4000)[:3]
+    header[67:69] = struct.pack('<H', sum(header[:67]))
+
+    for prefix in ('', str(header)):
+        fd, fname = tempfile.mkstemp(suffix='.scr')
+        os.write(fd, prefix + dump.tostring())
+        os.close(fd)
+        with ScreenFile(fname, mode=0) as screen:
+            assert (screen.header is None) == (prefix == '')
+            assert screen.get_line(8).tobytes() == \
+                    dump[table[8] - 0xC000].tostring()
+            assert len(screen.get_block(0xC800)) == BLOCK_SIZE
+            assert (screen.get_pens(10, 4, 2, 3) ==
+                    decode_bytes(dump[table[10:12, 4:7] - 0xC000], 0)).all()
+        os.remove(fname)
+
+    # Raw dumps with a blank top line (zeros pass the checksum) or a header
+    # which does not contain the screen
+    blank = dump.copy()
+    blank[:0x1000] = 0
+    wrong = header[:]
+    wrong[21:23] = struct.pack('<H', 0x4000)
+    wrong[67:69] = struct.pack('<H', sum(wrong[:67]))
+    for prefix, content in (('', blank), (str(wrong), dump)):
+        fd, fname = tempfile.mkstemp(suffix='.scr')
+        os.write(fd, prefix + content.tostring())
+        os.close(fd)
+        raw = np.frombuffer(prefix + content.tostring(), dtype=np.uint8)
+        with ScreenFile(fname, mode=0) as screen:
+            assert screen.header is None
+            assert screen.base == 0xC000
+            assert screen.get_line(1).tobytes() == \
+                    raw[table[1] - 0xC000].tostring()
+        os.remove(fname)
+
+
+if __name__ == '__main__':
+    test_screen_file()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Screen memory layout.
+
+Map the bytes of the screen displayed by the CRTC to their address in the CPC
+memory, and reorder whole screens between a linear layout (one line of bytes
+after the other) and the CPC layout.
+
+The CRTC displays R6 char lines of R9+1 lines, each of R1 words (2 bytes).
+The memory address of a byte is built from the memory address MA of the word
+(R12/R13 plus R1 words per char line) and the line RA in the char line:
+
+    ((MA & 0x3000) << 2) | ((RA & 7) << 11) | ((MA & 0x3FF) << 1) | byte
+"""
+
+# imports
+import numpy as np
+
+# code
+
+# Already computed address tables
+_address_tables = {}
+
+
+def get_screen_address(R12, R13):
+    """Return the memory address of the first byte of the screen.
+
+    Parameters
+    ----------
+        - R12, R13: int
+            Values of the CRTC registers 12 and 13
+    """
+    MA = (R12 << 8) | R13
+    return ((MA & 0x3000) << 2) | ((MA & 0x3FF) << 1)
+
+
+def get_address_table(R1, R6, R9, R12, R13):
+    """Return the memory address of each byte of the screen.
+    Tables are computed once for each configuration, and are read only.
+
+    Parameters
+    ----------
+        - R1, R6, R9, R12, R13: int
+            Values of the CRTC registers
+
+    Returns
+    -------
+        uint16 array of R6 * (R9 + 1) lines of 2 * R1 bytes
+    """
+    key = (R1, R6, R9, R12, R13)
+    if key not in _address_tables:
+        char_lines = np.arange(R6).reshape(R6, 1, 1)
+        lines = np.arange(R9 + 1).reshape(1, R9 + 1, 1)
+        words = np.arange(R1).reshape(1, 1, R1)
+
+        MA = (((R12 << 8) | R13) + char_lines * R1 + words) & 0x3FFF
+        word_addresses = ((MA & 0x3000) << 2) | ((lines & 7) << 11) | \
+                ((MA & 0x3FF) << 1)
+        addresses = np.empty((R6, R9 + 1, R1, 2), dtype=np.uint16)
+        addresses[..., 0] = word_addresses
+        addresses[..., 1] = word_addresses + 1
+
+        table = addresses.reshape(R6 * (R9 + 1), 2 * R1)
+        table.flags.writeable = False
+        _address_tables[key] = table
+    return _address_tables[key]
+
+
+def cpc_to_linear(memory, table, base=0):
+    """Extract the screen from the CPC memory.
+
+    Parameters
+    ----------
+        - memory: str, bytearray or array
+            Memory starting at address base
+        - table: array
+            Address table of the screen (see get_address_table)
+        - base: int
+            Address of the first byte of memory
+
+    Returns
+    -------
+        uint8 array of the bytes of the screen (one line per screen line)
+    """
+    if not isinstance(memory, np.ndarray):
+        memory = np.frombuffer(memory, dtype=np.uint8)
+    return memory[table - base] if base else memory[table]
+
+
+def linear_to_cpc(screen, table, memory=None, base=0):
+    """Store the screen in the CPC memory.
+
+    Parameters
+    ----------
+        - screen: array
+            Bytes of the screen (one line per screen line)
+        - table: array
+            Address table of the screen (see get_address_table)
+        - memory: array
+            Writable uint8 array of the memory starting at address base
+            (large enough for the screen if None)
+        - base: int
+            Address of the first byte of memory
+
+    Returns
+    -------
+        The memory array
+    """
+    if memory is None:
+        memory = np.zeros(int(table.max()) - base + 1, dtype=np.uint8)
+    memory[table - base if base else table] = screen
+    return memory
+
+
+def test_address_table():
+    """Check the standard and overscan layouts"""
+    table = get_address_table(40, 25, 7, 0x30, 0x00)
+    assert table.shape == (200, 80)
+    assert table[0, 0] == 0xC000
+    assert table[1, 0] == 0xC800
+    assert table[8, 0] == 0xC050
+    assert table[199, 79] == 0xFFCF
+    assert get_screen_address(0x30, 0x00) == 0xC000
+
+    # 32KB overscan: the screen continues from 0x8000 to 0xC000
+    table = get_address_table(48, 34, 7, 0x2C, 0x00)
+    assert table[0, 0] == 0x8000
+    assert table[7, 0] == 0xB800
+    assert len(np.unique(table)) == table.size
+    assert table.max() >= 0xC000
+
+    screen = np.arange(table.size, dtype=np.uint32).astype(np.uint8)
+    screen = screen.reshape(table.shape)
+    memory = linear_to_cpc(screen, table, base=0x8000)
+    assert (cpc_to_linear(memory, table, base=0x8000) == screen).all()
+
+
+if __name__ == '__main__':
+    test_address_table()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
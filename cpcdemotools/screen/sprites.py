@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Sprites extraction.
+
+Encode the sprites of an image of pens in one pass, store each different
+sprite once in a binary blob (a sprite identical to another one, or to its
+mirror, only gets an index entry) and build the index of the sprites.
+"""
+
+# imports
+import collections
+import struct
+
+import numpy as np
+
+from bulk_encoding import encode_pens, PIXELS_PER_BYTE
+
+# code
+
+# Flags of the packed index
+FLIP_X_FLAG = 1
+FLIP_Y_FLAG = 2
+
+SpriteEntry = collections.namedtuple('SpriteEntry', [
+    'offset',           # Offset of the bytes in the blob
+    'width',            # Width in bytes
+    'height',           # Height in lines
+    'flip_x',           # True if the stored bytes must be mirrored left/right
+    'flip_y',           # True if the stored lines must be drawn bottom-up
+    ])
+
+SpriteSheet = collections.namedtuple('SpriteSheet', [
+    'blob',             # Bytes of the different sprites (line after line)
+    'entries',          # SpriteEntry of each sprite
+    ])
+
+
+def get_grid_rectangles(nb_columns, nb_rows, width, height, x=0, y=0):
+    """Return the rectangles of a grid of sprites.
+
+    Parameters
+    ----------
+        - nb_columns, nb_rows: int
+            Number of sprites in the grid
+        - width, height: int
+            Size of a sprite in pixels
+        - x, y: int
+            Position of the grid in pixels
+
+    Returns
+    -------
+        List of (x, y, width, height), line after line
+    """
+    return [(x + column * width, y + row * height, width, height)
+            for row in range(nb_rows)
+            for column in range(nb_columns)]
+
+
+def _encode_rectangles(pens, rectangles, mode):
+    """Encode rectangles of the same size, and their mirrors.
+
+    Returns
+    -------
+        Dict of the uint8 arrays (sprites, lines, bytes) of each (flip_x,
+        flip_y)
+    """
+    x, y, width, height = [np.array(_).reshape(-1, 1, 1)
+                           for _ in zip(*rectangles)]
+    width, height = width[0, 0, 0], height[0, 0, 0]
+    lines = y + np.arange(height).reshape(1, -1, 1)
+    columns = x + np.arange(width).reshape(1, 1, -1)
+    sprites = pens[lines, columns]
+
+    encoded = {}
+    for flip_x in (False, True):
+        for flip_y in (False, True):
+            flipped = sprites[:, ::-1 if flip_y else 1, ::-1 if flip_x else 1]
+            stacked = flipped.reshape(-1, width)
+            encoded[flip_x, flip_y] = encode_pens(stacked, mode).reshape(
+                    len(rectangles), height, -1)
+    return encoded
+
+
+def extract_sprites(pens, rectangles, mode, mirrors=True):
+    """Encode and deduplicate sprites.
+
+    Parameters
+    ----------
+        - pens: array
+            2D array of pens of the image
+        - rectangles: list
+            (x, y, width, height) of each sprite in pixels. x and width must
+            be multiples of the number of pixels in a byte, and the sprites
+            must be in the image
+        - mode: int
+            Screen mode (0, 1 or 2)
+        - mirrors: bool
+            if True, a sprite which is the mirror of a stored one is not
+            stored again
+
+    Returns
+    -------
+        A SpriteSheet
+    """
+    pens = np.asarray(pens)
+    nb_pixels = PIXELS_PER_BYTE[mode]
+    for rectangle in rectangles:
+        x, y, width, height = rectangle
+        if x % nb_pixels or width % nb_pixels:
+            raise ValueError('Sprite %s is not aligned on bytes'
+                             % (rectangle,))
+        if min(rectangle) < 0 or x + width > pens.shape[1] or \
+                y + height > pens.shape[0]:
+            raise ValueError('Sprite %s is not in the image' % (rectangle,))
+
+    # Encode the sprites of each size at once
+    sizes = collections.defaultdict(list)
+    for index, rectangle in enumerate(rectangles):
+        sizes[tuple(rectangle[2:])].append(index)
+    encoded = [None] * len(rectangles)
+    for indices in sizes.values():
+        arrays = _encode_rectangles(pens, [rectangles[_] for _ in indices],
+                                    mode)
+        for position, index in enumerate(indices):
+            encoded[index] = dict((flips, array[position])
+                                  for flips, array in arrays.items())
+
+    blob = []
+    size = 0
+    offsets = {}
+    entries = []
+    for sprites in encoded:
+        height, width = sprites[False, False].shape
+
+        # A sprite whose mirror is stored is the mirror of the stored one
+        candidates = [(False, False)]
+        if mirrors:
+            candidates += [(True, False), (False, True), (True, True)]
+        flips = (False, False)
+        for candidate in candidates:
+            if (width, sprites[candidate].tostring()) in offsets:
+                flips = candidate
+                break
+
+        key = (width, sprites[flips].tostring())
+        if key not in offsets:
+            offsets[key] = size
+            blob.append(key[1])
+            size += len(key[1])
+        entries.append(SpriteEntry(offset=offsets[key],
+                                   width=width,
+                                   height=height,
+                                   flip_x=flips[0],
+                                   flip_y=flips[1]))
+
+    return SpriteSheet(blob=''.join(blob), entries=entries)
+
+
+def pack_index(sheet):
+    """Return the binary index of a sprite sheet.
+    Each sprite takes 5 bytes: offset (little endian word), width, height
+    and flags.
+
+    Parameters
+    ----------
+        - sheet: SpriteSheet
+            Sprites to index
+    """
+    return ''.join(struct.pack('<HBBB', entry.offset, entry.width,
+                               entry.height,
+                               (FLIP_X_FLAG if entry.flip_x else 0) |
+                               (FLIP_Y_FLAG if entry.flip_y else 0))
+                   for entry in sheet.entries)
+
+
+def test_extract_sprites():
+    """Extract a tile set with duplicated and mirrored tiles"""
+    random = np.random.RandomState(0)
+    tile = random.randint(0, 16, (8, 4))
+    other = random.randint(0, 16, (8, 4))
+    pens = np.hstack([tile, other, tile, tile[:, ::-1], tile[::-1, ::-1]])
+
+    sheet = extract_sprites(pens, get_grid_rectangles(5, 1, 4, 8), 0)
+    assert len(sheet.blob) == 2 * 8 * 2
+    offsets = [entry.offset for entry in sheet.entries]
+    assert offsets == [0, 16, 0, 0, 0]
+    assert [(entry.flip_x, entry.flip_y) for entry in sheet.entries] == \
+            [(False, False), (False, False), (False, False), (True, False),
+             (True, True)]
+    assert np.fromstring(sheet.blob[:16], dtype=np.uint8).tolist() == \
+            encode_pens(tile, 0).ravel().tolist()
+
+    sheet = extract_sprites(pens, get_grid_rectangles(5, 1, 4, 8), 0,
+                            mirrors=False)
+    assert len(sheet.blob) == 4 * 8 * 2
+    assert len(pack_index(sheet)) == 5 * 5
+
+    rectangles = [list(rectangle)
+                  for rectangle in get_grid_rectangles(5, 1, 4, 8)]
+    assert extract_sprites(pens, rectangles, 0).blob == \
+            extract_sprites(pens, get_grid_rectangles(5, 1, 4, 8), 0).blob
+    for rectangle in ((-2, 0, 4, 8), (0, 0, 4, 9), (18, 0, 4, 8)):
+        try:
+            extract_sprites(pens, [rectangle], 0)
+        except ValueError:
+            pass
+        else:
+            assert False, rectangle
+
+
+if __name__ == '__main__':
+    test_extract_sprites()
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
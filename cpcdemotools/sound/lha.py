@@ -0,0 +1,539 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""LHA decompression.
+
+Decompress the first file of LHA archives (-lh5- and stored -lh0- methods,
+headers of level 0, 1 and 2), as used to pack YM files, without external
+tool. Decompressed payloads can be kept in a cache directory.
+"""
+
+# imports
+import collections
+import hashlib
+import os
+import struct
+
+# code
+
+# Size of the sliding dictionary of -lh5-
+DICTIONARY_SIZE = 1 << 13
+
+# Number of symbols of the trees of -lh5-
+NC = 256 + 256 - 3 + 1      # Literals and match lengths
+NP = 14                     # Match positions
+NT = 19                     # Lengths of the literals tree
+
+LhaHeader = collections.namedtuple('LhaHeader', [
+    'method',           # Compression method (e.g. '-lh5-')
+    'packed_size',      # Size of the compressed data
+    'original_size',    # Size of the decompressed data
+    'filename',         # Name of the file
+    'crc',              # CRC16 of the decompressed data
+    'header_size',      # Size of the header (the compressed data follows)
+    ])
+
+
+def _get_crc_table():
+    """Return the table of the CRC16 used by LHA (polynom 0xA001)."""
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC_TABLE = _get_crc_table()
+
+
+def update_crc(crc, data):
+    """Update the LHA CRC16 with data (str or bytearray)."""
+    table = CRC_TABLE
+    for byte in bytearray(data):
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+def read_lha_header(f):
+    """Read the header of the first file of an LHA archive.
+    The position of f is left at the beginning of the compressed data.
+
+    Parameters
+    ----------
+        - f: file
+            Archive opened in binary mode, at its beginning
+
+    Returns
+    -------
+        An LhaHeader, or None if f is not an LHA archive (the position of
+        f is then unchanged)
+    """
+    start = f.tell()
+    data = f.read(22)
+    if len(data) < 22 or data[2] != '-' or data[6] != '-' or \
+            data[3:5] != 'lh':
+        f.seek(start)
+        return None
+
+    method = data[2:7]
+    packed_size, original_size = struct.unpack('<II', data[7:15])
+    level = ord(data[20])
+
+    if level in (0, 1):
+        header_size = ord(data[0]) + 2
+        data = data + f.read(header_size - 22)
+        name_length = ord(data[21])
+        filename = data[22:22 + name_length]
+        crc, = struct.unpack('<H', data[22 + name_length:24 + name_length])
+        if level == 1:
+            # Extended headers are counted in the packed size
+            next_size, = struct.unpack('<H', data[-2:])
+            while next_size:
+                extended = f.read(next_size)
+                header_size += next_size
+                packed_size -= next_size
+                next_size, = struct.unpack('<H', extended[-2:])
+
+    elif level == 2:
+        header_size, = struct.unpack('<H', data[0:2])
+        data = data + f.read(header_size - 22)
+        crc, = struct.unpack('<H', data[21:23])
+        filename = ''
+        position = 24
+        next_size, = struct.unpack('<H', data[position:position + 2])
+        while next_size:
+            extended = data[position + 2:position + next_size]
+            if extended[0] == '\x01':
+                filename = extended[1:]
+            position += next_size
+            next_size, = struct.unpack('<H', data[position:position + 2])
+
+    else:
+        raise ValueError('LHA header of level %d is not handled' % level)
+
+    return LhaHeader(method=method,
+                     packed_size=packed_size,
+                     original_size=original_size,
+                     filename=filename,
+                     crc=crc,
+                     header_size=header_size)
+
+
+class _BitReader(object):
+    """Read bits, most significant first, from a file."""
+
+    def __init__(self, f, size):
+        self._f = f
+        self._remaining = size
+        self._buffer = bytearray()
+        self._position = 0
+        self._bits = 0
+        self._nb_bits = 0
+
+    def _fill(self, nb_bits):
+        """Make at least nb_bits bits available (0 after the end)."""
+        while self._nb_bits < nb_bits:
+            if self._position == len(self._buffer):
+                size = min(self._remaining, 0x4000)
+                self._buffer = bytearray(self._f.read(size))
+                self._remaining -= len(self._buffer)
+                self._position = 0
+            if self._position < len(self._buffer):
+                byte = self._buffer[self._position]
+                self._position += 1
+            else:
+                byte = 0
+            self._bits = ((self._bits << 8) | byte) & 0xFFFFFFFF
+            self._nb_bits += 8
+
+    def peek(self, nb_bits):
+        """Return the next nb_bits bits (at most 24) without reading them."""
+        if self._nb_bits < nb_bits:
+            self._fill(nb_bits)
+        return (self._bits >> (self._nb_bits - nb_bits)) & \
+                ((1 << nb_bits) - 1)
+
+    def skip(self, nb_bits):
+        """Consume nb_bits bits."""
+        if self._nb_bits < nb_bits:
+            self._fill(nb_bits)
+        self._nb_bits -= nb_bits
+
+    def read(self, nb_bits):
+        """Read nb_bits bits (at most 24)."""
+        value = self.peek(nb_bits)
+        self._nb_bits -= nb_bits
+        return value
+
+
+class _HuffmanTable(object):
+    """Canonical Huffman decoding table of -lh5- (codes are assigned by
+    increasing length, then by increasing symbol)."""
+
+    def __init__(self, lengths=None, symbol=None):
+        """Build the table from the code length of each symbol, or for a
+        single symbol coded with 0 bits."""
+        if symbol is not None:
+            self._nb_bits = 0
+            self._symbols = [symbol]
+            self._lengths = [0]
+            return
+
+        self._nb_bits = max(lengths)
+        self._symbols = [0] * (1 << self._nb_bits)
+        self._lengths = [0] * (1 << self._nb_bits)
+        code = 0
+        for length in range(1, self._nb_bits + 1):
+            for symbol, symbol_length in enumerate(lengths):
+                if symbol_length != length:
+                    continue
+                span = 1 << (self._nb_bits - length)
+                start = code * span
+                if start + span > len(self._symbols):
+                    raise ValueError('Bad Huffman table')
+                self._symbols[start:start + span] = [symbol] * span
+                self._lengths[start:start + span] = [length] * span
+                code += 1
+            code <<= 1
+
+    def decode(self, reader):
+        """Read a symbol."""
+        index = reader.peek(self._nb_bits) if self._nb_bits else 0
+        reader.skip(self._lengths[index])
+        return self._symbols[index]
+
+
+def _read_pt_lengths(reader, nb_symbols, nb_bits, special):
+    """Read the code lengths of the positions or of the literals tree."""
+    n = reader.read(nb_bits)
+    if n == 0:
+        return _HuffmanTable(symbol=reader.read(nb_bits))
+
+    lengths = [0] * nb_symbols
+    i = 0
+    while i < n:
+        length = reader.peek(3)
+        reader.skip(3)
+        if length == 7:
+            while reader.read(1):
+                length += 1
+        lengths[i] = length
+        i += 1
+        if i == special:
+            i += reader.read(2)
+    return _HuffmanTable(lengths)
+
+
+def _read_c_lengths(reader, pt_table):
+    """Read the code lengths of the literals and match lengths."""
+    n = reader.read(9)
+    if n == 0:
+        return _HuffmanTable(symbol=reader.read(9))
+
+    lengths = [0] * NC
+    i = 0
+    while i < n:
+        c = pt_table.decode(reader)
+        if c == 0:
+            i += 1
+        elif c == 1:
+            i += reader.read(4) + 3
+        elif c == 2:
+            i += reader.read(9) + 20
+        else:
+            lengths[i] = c - 2
+            i += 1
+    return _HuffmanTable(lengths)
+
+
+def iter_lh5(f, packed_size, original_size, chunk_size=0x10000):
+    """Decompress -lh5- data.
+
+    Parameters
+    ----------
+        - f: file
+            File positioned at the beginning of the compressed data
+        - packed_size, original_size: int
+            Sizes of the compressed and decompressed data
+        - chunk_size: int
+            Approximative size of the yielded chunks
+
+    Returns
+    -------
+        Generator of the decompressed data (str chunks)
+    """
+    reader = _BitReader(f, packed_size)
+    window = bytearray()
+    remaining = original_size
+    block_size = 0
+    while remaining > 0:
+        if block_size == 0:
+            block_size = reader.read(16)
+            pt_table = _read_pt_lengths(reader, NT, 5, 3)
+            c_table = _read_c_lengths(reader, pt_table)
+            p_table = _read_pt_lengths(reader, NP, 4, -1)
+        block_size -= 1
+
+        c = c_table.decode(reader)
+        if c < 256:
+            window.append(c)
+            remaining -= 1
+        else:
+            length = min(c - 256 + 3, remaining)
+            p = p_table.decode(reader)
+            if p > 1:
+                p = (1 << (p - 1)) + reader.read(p - 1)
+            start = len(window) - p - 1
+            if start < 0:
+                raise ValueError('Corrupted -lh5- data')
+            if p + 1 >= length:
+                window += window[start:start + length]
+            else:
+                for k in range(length):
+                    window.append(window[start + k])
+            remaining -= length
+
+        if len(window) >= chunk_size + DICTIONARY_SIZE:
+            yield str(window[:-DICTIONARY_SIZE])
+            del window[:-DICTIONARY_SIZE]
+    yield str(window)
+
+
+def iter_decompress(f, chunk_size=0x10000, header=None):
+    """Decompress the first file of an LHA archive, chunk by chunk.
+
+    Parameters
+    ----------
+        - f: file
+            Archive opened in binary mode, at its beginning
+        - chunk_size: int
+            Approximative size of the yielded chunks
+        - header: LhaHeader
+            if not None, header already read by read_lha_header (f is then
+            at the beginning of the compressed data)
+
+    Returns
+    -------
+        Generator of the decompressed data (str chunks). The CRC is checked
+        once everything is decompressed
+    """
+    if header is None:
+        header = read_lha_header(f)
+    if header is None:
+        raise ValueError('Not an LHA archive')
+
+    if header.method == '-lh0-':
+        chunks = (f.read(min(chunk_size, header.original_size - offset))
+                  for offset in range(0, header.original_size, chunk_size))
+    elif header.method == '-lh5-':
+        chunks = iter_lh5(f, header.packed_size, header.original_size,
+                          chunk_size)
+    else:
+        raise ValueError('LHA method %s is not handled' % header.method)
+
+    crc = 0
+    for chunk in chunks:
+        crc = update_crc(crc, chunk)
+        yield chunk
+    if crc != header.crc:
+        raise ValueError('CRC error in LHA archive')
+
+
+def is_lha_file(fname):
+    """Test if a file is an LHA archive."""
+    with open(fname, 'rb') as f:
+        return read_lha_header(f) is not None
+
+
+def decompress(fname):
+    """Return the decompressed first file of an LHA archive."""
+    with open(fname, 'rb') as f:
+        return ''.join(iter_decompress(f))
+
+
+class LhaStream(object):
+    """Read only file object of the first file of an LHA archive,
+    decompressed as it is read. Only forward seeks are possible.
+    """
+
+    def __init__(self, fname, chunk_size=0x10000):
+        """Read the header of the archive.
+
+        Parameters
+        ----------
+            - fname: str
+                Name of the archive
+            - chunk_size: int
+                Approximative size of the decompressed chunks
+        """
+        self._f = open(fname, 'rb')
+        self.header = read_lha_header(self._f)
+        if self.header is None:
+            self._f.close()
+            raise ValueError('%s is not an LHA archive' % fname)
+
+        self._chunks = iter_decompress(self._f, chunk_size, self.header)
+        self._chunk = ''
+        self._offset = 0
+        self._position = 0
+
+    def read(self, size=-1):
+        """Read at most size bytes (all the remaining ones if size < 0)."""
+        data = []
+        while size:
+            if self._offset == len(self._chunk):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._chunk = chunk
+                self._offset = 0
+                continue
+
+            if size < 0:
+                end = len(self._chunk)
+            else:
+                end = min(len(self._chunk), self._offset + size)
+                size -= end - self._offset
+            data.append(self._chunk[self._offset:end])
+            self._position += end - self._offset
+            self._offset = end
+        return ''.join(data)
+
+    def seek(self, offset, whence=0):
+        """Move forward to a position (as file.seek)."""
+        if whence == 1:
+            offset += self._position
+        elif whence == 2:
+            offset += self.header.original_size
+        if offset < self._position:
+            raise IOError('Cannot seek backward in an LHA archive')
+
+        while self._position < offset:
+            if not self.read(min(offset - self._position, 0x10000)):
+                break
+
+    def tell(self):
+        """Return the position in the decompressed data."""
+        return self._position
+
+    def close(self):
+        """Close the archive."""
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PayloadCache(object):
+    """Directory of decompressed payloads of LHA archives.
+    Payloads are keyed on the SHA1 of the archives, so renamed or copied
+    archives are only decompressed once.
+    """
+
+    def __init__(self, directory):
+        """Create the directory if needed.
+
+        Parameters
+        ----------
+            - directory: str
+                Directory of the payloads
+        """
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get_path(self, fname):
+        """Return the path of the decompressed payload of an archive,
+        decompressing it if it is not in the cache yet."""
+        digest = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(0x10000), ''):
+                digest.update(chunk)
+        path = os.path.join(self._directory, digest.hexdigest())
+
+        if not os.path.exists(path):
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            try:
+                with open(fname, 'rb') as f:
+                    with open(tmp_path, 'wb') as payload:
+                        for chunk in iter_decompress(f):
+                            payload.write(chunk)
+            except:
+                # Do not leave partial payloads in the cache
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            os.rename(tmp_path, path)
+        return path
+
+
+# Level 0 archive of 'YM6!' + 100 * 'LeOnArD!' + 'End!'
+TEST_ARCHIVE = (
+    '1d512d6c68352d260000002803000000000000200007746573742e796d881a00'
+    '13436e867fb035801f5fe42991595cabd4191ecd2e8001001a8f23e48fea967f'
+    '9ffdfd85a000').decode('hex')
+
+
+def test_decompress():
+    """Decompress a small archive, and detect its corruption"""
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    fname = os.path.join(directory, 'test.lzh')
+    with open(fname, 'wb') as f:
+        f.write(TEST_ARCHIVE)
+
+    assert is_lha_file(fname)
+    with open(fname, 'rb') as f:
+        header = read_lha_header(f)
+        assert f.tell() == header.header_size
+    assert header.method == '-lh5-'
+    assert header.filename == 'test.ym'
+    payload = 'YM6!' + 'LeOnArD!' * 100 + 'End!'
+    assert decompress(fname) == payload
+
+    cache = PayloadCache(os.path.join(directory, 'cache'))
+    path = cache.get_path(fname)
+    assert open(path, 'rb').read() == payload
+    assert cache.get_path(fname) == path
+
+    with LhaStream(fname) as stream:
+        assert stream.read(4) == 'YM6!'
+        stream.seek(8, 1)
+        assert stream.tell() == 12
+        assert stream.read() == payload[12:]
+        assert stream.read() == ''
+
+    with open(fname, 'wb') as f:
+        f.write(TEST_ARCHIVE[:-4] + '\xff' + TEST_ARCHIVE[-3:])
+    try:
+        decompress(fname)
+        assert False, 'Corruption not detected'
+    except ValueError:
+        pass
+    try:
+        cache.get_path(fname)
+        assert False, 'Corruption not detected'
+    except ValueError:
+        pass
+    assert os.listdir(os.path.join(directory, 'cache')) == \
+            [os.path.basename(path)]
+
+
+if __name__ == '__main__':
+    test_decompress()
+
+
+# metadata
+__author__ = 'Krusty/Benediction'
+__copyright__ = 'Copyright 2012, Benediction'
+__credits__ = ['Krusty/Benediction']
+__licence__ = 'GPL'
+__version__ = '0.1'
+__maintainer__ = 'Krusty/Benediction'
+__email__ = 'krusty@cpcscene.com'
+__status__ = 'Prototype'
@@ -7,19 +7,56 @@ Read an YM file in order to graphically analyse the content of the register.
 """
 
 # imports
+import os
 import struct
 import sys
+import tempfile
+
+import numpy as np
+
+try:
+    from cpcdemotools.sound import lha
+except ImportError:
+    # Run from the source tree
+    import lha
 
 # code
 
+# Formats made of the values of 14 registers only
+OLD_FORMATS = ('YM2!', 'YM3!', 'YM3b')
+
+# Number of frames read at once by iter_frames
+READ_FRAMES = 1024
+
 class YMReader(object):
     """YMReader.
     
-    Read YM file according to http://leonard.oxg.free.fr/ymformat.html"""
-
-    def __init__(self, fname):
+    Read YM file according to http://leonard.oxg.free.fr/ymformat.html
+    LHA compressed files (as distributed) are decompressed on the fly."""
+
+    def __init__(self, fname, use_mmap=False, cache=None,
+                 load_registers=True):
+        """Read the YM file.
+
+        Parameters
+        ----------
+            - fname: str
+                Name of the YM file
+            - use_mmap: bool
+                if True, the register values and digidrums are memory mapped
+                from the file instead of being read
+            - cache: lha.PayloadCache
+                if not None, compressed files are decompressed in this cache
+                (and can then be memory mapped)
+            - load_registers: bool
+                if False, only the header is read, and the frames are read
+                with iter_frames
+        """
         super(YMReader, self).__init__()
         self._fname = fname
+        self._use_mmap = use_mmap
+        self._cache = cache
+        self._load_registers = load_registers
 
         self.extract_information()
 
@@ -27,27 +64,167 @@ class YMReader(object):
         """Return true if the data are interleaved"""
         return (self._song_attributes & 1) == 1
 
+    def get_registers(self):
+        """Return the values of the registers as a nb registers (14 for
+        YM2/YM3, 16 otherwise) x nb frames uint8 array (line R holds the
+        values of register R), or None if they are not loaded"""
+        return self._registers
+
+    def iter_frames(self, chunk_size=None):
+        """Iterate on the frames, read from the file (or decompressed) as
+        they are needed. Interleaved data are read register by register
+        (compressed ones go through a temporary file), so memory stays
+        bounded whatever the size of the tune.
+
+        Parameters
+        ----------
+            - chunk_size: int
+                if None, yield each frame, else yield chunks of chunk_size
+                frames (the last one can be shorter)
+
+        Returns
+        -------
+            Generator of the uint8 arrays of the values of the registers of
+            each frame (nb registers) or of each chunk (nb frames x nb
+            registers)
+        """
+        nb_frames = READ_FRAMES if chunk_size is None else chunk_size
+        f, data_fname, size = self._open()
+        try:
+            offset = self._data_offset
+            f.seek(offset)
+            if self.are_data_interleaved() and data_fname is None:
+                # Decompressed data are only read forward
+                spill = tempfile.TemporaryFile()
+                remaining = self._nb_registers * self._nb_frames
+                while remaining:
+                    data = f.read(min(remaining, 0x10000))
+                    assert data, 'Error, %s is truncated' % self._fname
+                    spill.write(data)
+                    remaining -= len(data)
+                f.close()
+                f, offset = spill, 0
+
+            for start in range(0, self._nb_frames, nb_frames):
+                count = min(nb_frames, self._nb_frames - start)
+                if self.are_data_interleaved():
+                    chunk = np.empty((count, self._nb_registers),
+                                     dtype=np.uint8)
+                    for R in range(self._nb_registers):
+                        f.seek(offset + R * self._nb_frames + start)
+                        chunk[:, R] = np.frombuffer(f.read(count),
+                                                    dtype=np.uint8)
+                else:
+                    chunk = np.frombuffer(f.read(count * self._nb_registers),
+                                          dtype=np.uint8)
+                    chunk = chunk.reshape(count, self._nb_registers)
+
+                if chunk_size is None:
+                    for frame in chunk:
+                        yield frame
+                else:
+                    yield chunk
+        finally:
+            f.close()
+
+    def get_digidrums(self):
+        """Return the samples of the digidrums (list of memoryview)"""
+        return self._digidrums
+
+    def get_loop_frame(self):
+        """Return the frame where the tune loops"""
+        return self._loop_frame
+
+    def _open(self):
+        """Open the raw YM data of the file, decompressing it if needed.
+
+        Returns
+        -------
+            (file, name of the file or None if the data are decompressed as
+            they are read, size of the data)
+        """
+        f = open(self._fname, 'rb')
+        if lha.read_lha_header(f) is None:
+            return f, self._fname, os.path.getsize(self._fname)
+
+        f.close()
+        if self._cache is not None:
+            fname = self._cache.get_path(self._fname)
+            return open(fname, 'rb'), fname, os.path.getsize(fname)
+
+        stream = lha.LhaStream(self._fname)
+        return stream, None, stream.header.original_size
+
     def extract_information(self):
         """Extract the data from the YM file"""
 
-        f = open(self._fname)
+        f, data_fname, size = self._open()
+
+        def read_block(size):
+            """Read size bytes as a uint8 array (memory mapped if possible)"""
+            if self._use_mmap and data_fname is not None and size:
+                block = np.memmap(data_fname, dtype=np.uint8, mode='r',
+                                  offset=f.tell(), shape=(size,))
+                f.seek(size, 1)
+            else:
+                block = np.frombuffer(f.read(size), dtype=np.uint8)
+            assert len(block) == size, 'Error, %s is truncated' % self._fname
+            return block
 
         def extract_header():
             """Extract header information"""
 
-            header = struct.unpack('>4s8siiHiHiH', f.read(34))
-            assert header[0] == 'YM6!', 'Error, %s is not an YM6 file!'
-
-            self._nb_frames = header[2]
-            self._song_attributes = header[3]
-            self._nb_digidrums = header[4]
-            self._ym_clock = header[5]
-            self._original_player_frame = header[6]
-            self._loop_frame = header[7]
-            self._size_additional = header[8]
+            self._format = f.read(4)
+
+            # Default values of the formats without them
+            self._song_attributes = 1
+            self._nb_digidrums = 0
+            self._ym_clock = 2000000
+            self._original_player_frame = 50
+            self._loop_frame = 0
+            self._size_additional = 0
+            self._nb_registers = 16
+
+            if self._format in OLD_FORMATS:
+                # Only the values of 14 registers (and the loop frame)
+                values_size = size - (8 if self._format == 'YM3b' else 4)
+                self._nb_registers = 14
+                self._nb_frames = values_size // 14
+
+            elif self._format == 'YM4!':
+                header = struct.unpack('>8siiii', f.read(24))
+                assert header[0] == 'LeOnArD!', \
+                        'Error, %s is not an YM file!' % self._fname
+
+                self._nb_frames = header[1]
+                self._song_attributes = header[2]
+                self._nb_digidrums = header[3]
+                self._loop_frame = header[4]
+
+            elif self._format in ('YM5!', 'YM6!'):
+                header = struct.unpack('>8siiHiHiH', f.read(30))
+                assert header[0] == 'LeOnArD!', \
+                        'Error, %s is not an YM file!' % self._fname
+
+                self._nb_frames = header[1]
+                self._song_attributes = header[2]
+                self._nb_digidrums = header[3]
+                self._ym_clock = header[4]
+                self._original_player_frame = header[5]
+                self._loop_frame = header[6]
+                self._size_additional = header[7]
+                f.seek(self._size_additional, 1)
 
+            else:
+                assert False, 'Error, %s is not an YM file!' % self._fname
 
-            assert self._nb_digidrums == 0, 'Error, we do not treat digidrums'
+        def extract_digidrums():
+            """Extract the samples of the digidrums (without copy)"""
+            digidrums = []
+            for digidrum in range(self._nb_digidrums):
+                size, = struct.unpack('>i', f.read(4))
+                digidrums.append(memoryview(read_block(size)))
+            return digidrums
 
         def extract_string():
             """Extract a string (until is 0 is met)"""
@@ -65,23 +242,42 @@ class YMReader(object):
         def extract_values():
             """Extract the values of each registers"""
 
+            # All the values at once
+            values = read_block(self._nb_registers * self._nb_frames)
+
             if self.are_data_interleaved():
-                # Loop among all registers
-                self._registers = []
-                for R in range(16):
-                    self._registers.append([ord(_) for _ in f.read(self._nb_frames)])
+                # One line per register
+                self._registers = values.reshape(self._nb_registers,
+                                                 self._nb_frames)
             else:
-                assert False, "You need to use an interleaved YM"
+                # One line per frame, transposed (without copy)
+                self._registers = values.reshape(self._nb_frames,
+                                                 self._nb_registers).T
 
 
         # Get the informations from the file
         extract_header()
-        self._song_name = extract_string()
-        self._author_name = extract_string()
-        self._song_comment = extract_string()
-        extract_values()
-
-        assert "End!" == f.read(), 'Error while reading the YM file'
+        self._digidrums = extract_digidrums()
+        if self._format in OLD_FORMATS:
+            self._song_name = self._author_name = self._song_comment = ''
+        else:
+            self._song_name = extract_string()
+            self._author_name = extract_string()
+            self._song_comment = extract_string()
+        self._data_offset = f.tell()
+
+        if self._load_registers:
+            extract_values()
+        else:
+            self._registers = None
+            if self._format == 'YM3b':
+                f.seek(self._nb_registers * self._nb_frames, 1)
+
+        if self._format == 'YM3b':
+            # Little endian, as read by ST-Sound
+            self._loop_frame, = struct.unpack('<I', f.read(4))
+        if self._format not in OLD_FORMATS and self._load_registers:
+            assert "End!" == f.read(), 'Error while reading the YM file'
         f.close()
         
 
@@ -89,6 +285,7 @@ class YMReader(object):
         string = """
         %s
 
+        Format:\t%s
         Nb frames:\t%d
         Attributes:\t%d (Interleaved=%i)
         Nb digidrums:\t%d
@@ -101,6 +298,7 @@ class YMReader(object):
         Author name:\t %s
         Song comment:\t %s
         """ % (self._fname,
+               self._format,
                self._nb_frames ,
                self._song_attributes ,
                self.are_data_interleaved(),
@@ -16,6 +16,7 @@ setup(name='cpcdemotools',
           'cpcdemotools.curves',
           'cpcdemotools.graph',
           'cpcdemotools.screen',
+          'cpcdemotools.crtc',
       ],
       scripts=[
           'cpcdemotools/source_checker/z80_syntax_checker.py',